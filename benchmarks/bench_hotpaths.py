@@ -0,0 +1,265 @@
+"""Microbenchmarks for the pure-Python hot paths in bot.py at 1k, 100k and 1M players/questions.
+
+    python benchmarks/bench_hotpaths.py                      # all benchmarks, all scales
+    python benchmarks/bench_hotpaths.py --scales 1000 100000 --only rank
+    python benchmarks/bench_hotpaths.py --fail-on-regression  # exit 1 if anything got slower
+
+Each run is written to benchmarks/results/<time>-<commit>.json and compared with
+the previous result file, so a regression shows up as a ratio against the last
+release that was measured on the same machine. The 1M scale takes several
+minutes and a few GB of memory.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SCALES = (1_000, 100_000, 1_000_000)
+
+# bot.py reads these at import time
+for name, value in (("TELEGRAM_BOT_TOKEN", "123456:bench"), ("CHANNEL_ID", "-1001"),
+                    ("OWNER_TELEGRAM_ID", "1"), ("SECOND_OWNER", "2")):
+    os.environ.setdefault(name, value)
+sys.path.insert(0, ROOT)
+import bot  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def make_board(n, rng):
+    # Scores cluster low like a real board: many casual players, a long tail of regulars
+    return {str(100000 + i): {"username": f"player{i}", "score": int(rng.expovariate(1 / 20)),
+                              "total_answers": 0, "correct_answers": 0} for i in range(n)}
+
+
+def make_questions(n):
+    return [{"id": i, "question": f"Question {i}?", "options": [f"{i}a", f"{i}b", f"{i}c", f"{i}d"],
+             "correct_option": f"{i}b", "explanation": "Benchmark"} for i in range(n)]
+
+
+def use_board(board):
+    bot.leaderboard = board
+    bot.ranking_index.rebuild(board)
+
+
+# Each benchmark takes (n, rng) and returns (operation, operations per call)
+
+def bench_ranking_rebuild(n, rng):
+    board = make_board(n, rng)
+    return lambda: bot.ranking_index.rebuild(board), 1
+
+
+def bench_ranking_update(n, rng):
+    board = make_board(n, rng)
+    use_board(board)
+    user_ids = rng.choices(list(board), k=1000)
+
+    def update():
+        for user_id in user_ids:
+            bot.ranking_index.update(user_id, bot.ranking_index.scores[user_id] + 1)
+    return update, len(user_ids)
+
+
+def bench_rank_lookup(n, rng):
+    board = make_board(n, rng)
+    use_board(board)
+    user_ids = rng.choices(list(board), k=1000)
+
+    def lookup():
+        for user_id in user_ids:
+            bot.ranking_index.rank(user_id)
+    return lookup, len(user_ids)
+
+
+def bench_leaderboard_render(n, rng):
+    """First page after a score change, as /leaderboard sees it"""
+    use_board(make_board(n, rng))
+
+    def render():
+        bot.ranking_index.version += 1  # Invalidate the page cache
+        bot.render_leaderboard_page("Global Leaderboard", 0)
+    return render, 1
+
+
+def bench_leaderboard_render_deep_page(n, rng):
+    """A page in the middle of the board, as stats_global_page_<n> paging sees it"""
+    use_board(make_board(n, rng))
+    page = len(bot.ranking_index) // bot.LEADERBOARD_PAGE_SIZE // 2
+
+    def render():
+        bot.ranking_index.version += 1
+        bot.render_leaderboard_page("Global Leaderboard", page)
+    return render, 1
+
+
+def bench_leaderboard_render_cached(n, rng):
+    use_board(make_board(n, rng))
+    bot.render_leaderboard_page("Global Leaderboard", 0)
+    return lambda: bot.render_leaderboard_page("Global Leaderboard", 0), 1
+
+
+def bench_compile_questions(n, rng):
+    """Building CompiledQuestion records from scratch"""
+    questions = make_questions(n)
+    return lambda: [bot.CompiledQuestion(question) for question in questions], n
+
+
+def bench_recompile_questions(n, rng):
+    """Lining compiled_questions up after a bank sync where every question was already compiled"""
+    bot.questions = make_questions(n)
+    bot.recompile_questions(bot.questions)
+    for position in range(n):
+        bot.compiled_question(position)
+    merged = make_questions(n)
+    return lambda: bot.recompile_questions(merged), n
+
+
+def bench_merge_questions(n, rng):
+    """A bank sync where every fetched question is already known"""
+    known = make_questions(n)
+    fetched = make_questions(n)
+    loop = asyncio.new_event_loop()
+
+    async def merge():
+        async def source():
+            for question in fetched:
+                yield question
+        await bot.merge_questions(known, source())
+    return lambda: loop.run_until_complete(merge()), n
+
+
+def bench_next_daily_question(n, rng):
+    """Question selection in send_question: claim the cursor, fetch or build the compiled question"""
+    bot.questions = make_questions(n)
+    bot.recompile_questions(bot.questions)
+    backend = bot.MemoryStateBackend()
+    loop = asyncio.new_event_loop()
+
+    async def select():
+        backend.cursors["daily"] = 0
+        for _ in range(1000):
+            bot.compiled_question(await backend.next_cursor("daily") % n)
+    return lambda: loop.run_until_complete(select()), 1000
+
+
+def bench_first_unused_question(n, rng):
+    """Finding where the daily questions resume after a restart"""
+    store = bot.QuizStore(os.path.join(tempfile.mkdtemp(prefix="quizbot-bench-"), "quiz.db"))
+    store.open()
+    store.save_questions("daily", make_questions(n))
+    for question_id in range(0, n // 2, max(1, n // 2000)):
+        store.mark_used("daily", question_id)
+    return lambda: store.first_unused("daily"), 1
+
+
+def bench_filter_used_weekly(n, rng):
+    """The unused weekly question filter in start_test_command"""
+    questions = make_questions(n)
+    used = set(range(0, n, 2))
+    return lambda: [q for q in questions if q.get("id") not in used], n
+
+
+def bench_weekly_get_results(n, rng):
+    test = bot.WeeklyTest(-1001, -1002)
+    test.participants = {str(100000 + i): {"name": f"player{i}", "score": rng.randrange(11)} for i in range(n)}
+    return test.get_results, 1
+
+
+BENCHMARKS = {name[len("bench_"):]: function for name, function in globals().items() if name.startswith("bench_")}
+
+
+def measure(operation, ops, repeat):
+    """Best and median seconds per operation over repeat timed batches"""
+    timer = timeit.Timer(operation)
+    number, _ = timer.autorange()
+    timings = [elapsed / number / ops for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return {"best": min(timings), "median": statistics.median(timings), "calls": number * repeat}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_results(path=None):
+    if path is None:
+        files = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+        if not files:
+            return None
+        path = files[-1]
+    with open(path) as f:
+        return json.load(f)
+
+
+def format_seconds(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=list(SCALES))
+    parser.add_argument("--only", nargs="+", default=[], help="run benchmarks whose name contains any of these")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", help="result file to compare with, default the latest in benchmarks/results")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-save", action="store_true", help="do not write a result file")
+    args = parser.parse_args()
+
+    baseline = previous_results(args.baseline)
+    results = {}
+    regressions = []
+    print(f"{'benchmark':34} {'scale':>9} {'per op':>10} {'baseline':>10} {'change':>8}")
+    for name, function in BENCHMARKS.items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+        for scale in args.scales:
+            operation, ops = function(scale, random.Random(scale))
+            result = results.setdefault(name, {})[str(scale)] = measure(operation, ops, args.repeat)
+            before = (baseline or {}).get("results", {}).get(name, {}).get(str(scale))
+            change = ""
+            if before:
+                ratio = result["best"] / before["best"]
+                change = f"{(ratio - 1) * 100:+.0f}%"
+                if ratio > args.threshold:
+                    change += " !"
+                    regressions.append((name, scale, ratio))
+            print(f"{name:34} {scale:>9} {format_seconds(result['best']):>10} "
+                  f"{format_seconds(before['best']) if before else '-':>10} {change:>8}")
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = git_commit()
+        path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+        with open(path, "w") as f:
+            json.dump({"commit": commit, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                       "python": platform.python_version(), "machine": platform.machine(),
+                       "baseline": baseline and baseline.get("commit"), "results": results}, f, indent=2)
+        print(f"Saved {os.path.relpath(path, ROOT)}")
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.threshold:.2f}x: "
+              + ", ".join(f"{name}@{scale} {ratio:.2f}x" for name, scale, ratio in regressions))
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,28 @@ import os
 import logging
 import random
 import json
-import requests
 import time
 import aiohttp
 import asyncio
 import pytz
 import base64
+import bisect
+import collections
+import heapq
+import itertools
+import math
+import codecs
+import functools
+import signal
+import sys
+import threading
+import traceback
+from aiohttp import web
+import sqlite3
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Poll
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, JobQueue, PollAnswerHandler, filters
 
 # Logging setup
@@ -24,70 +38,1274 @@ CHANNEL_ID = int(os.getenv("CHANNEL_ID"))
 OWNER_ID = int(os.getenv("OWNER_TELEGRAM_ID"))
 SECOND_OWNER = int(os.getenv("SECOND_OWNER"))
 DISCUSSION_GROUP_ID = int(os.getenv("DISCUSSION_GROUP_ID", "0"))
+# Quiz channels as "channel_id:group_id,..."; defaults to CHANNEL_ID with DISCUSSION_GROUP_ID
+QUIZ_CHANNELS = {
+    int(channel_id): int(group_id or DISCUSSION_GROUP_ID)
+    for channel_id, _, group_id in (entry.strip().partition(":") for entry in os.getenv("QUIZ_CHANNELS", "").split(",") if entry.strip())
+} or {CHANNEL_ID: DISCUSSION_GROUP_ID}
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 QUESTIONS_JSON_URL = os.getenv("QUESTIONS_JSON_URL")
 LEADERBOARD_JSON_URL = os.getenv("LEADERBOARD_JSON_URL")
 WEEKLY_QUESTIONS_JSON_URL = os.getenv("WEEKLY_QUESTIONS_JSON_URL")
 PORT = int(os.getenv("PORT", "5000"))
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")  # Bot API endpoint, the token is appended
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")  # Where the leaderboard file is written
 
 # Constants
-QUESTION_DURATION = 30  # Default duration (seconds)
-NEXT_QUESTION_DELAY = 2  # seconds between questions
-MAX_QUESTIONS = 10  # Maximum number of questions per test
+QUESTION_DURATION = int(os.getenv("QUESTION_DURATION", "30"))  # Default duration (seconds)
+NEXT_QUESTION_DELAY = int(os.getenv("NEXT_QUESTION_DELAY", "2"))  # seconds between questions
+MAX_QUESTIONS = int(os.getenv("MAX_QUESTIONS", "10"))  # Maximum number of questions per test
+LEADERBOARD_FLUSH_INTERVAL = int(os.getenv("LEADERBOARD_FLUSH_INTERVAL", "30"))  # seconds between leaderboard flushes
+LEADERBOARD_FLUSH_THRESHOLD = int(os.getenv("LEADERBOARD_FLUSH_THRESHOLD", "50"))  # pending changes that force a flush
+LEADERBOARD_PAGE_SIZE = 20  # Players per leaderboard page
+MAX_USERNAME_LENGTH = 32  # Longer names are truncated on the leaderboard
+TELEGRAM_MESSAGE_LIMIT = 4096  # Maximum characters in one Telegram message
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", "15"))  # seconds per outgoing HTTP request
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "10"))  # concurrent outgoing HTTP requests
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL")  # redis://... to share state between workers
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"  # Set to 0 on all but one worker
+ANSWER_BATCH_WINDOW_MS = int(os.getenv("ANSWER_BATCH_WINDOW_MS", "50"))  # 0 applies every answer as it arrives
+ANSWER_REPLY_CONCURRENCY = int(os.getenv("ANSWER_REPLY_CONCURRENCY", "16"))  # concurrent callback answer replies
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))  # updates processed at the same time
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))  # Bot API calls per second overall
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))  # calls per second to one private chat
+OUTBOX_GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", "20"))  # calls per minute to one group or channel
+DELETE_CONCURRENCY = int(os.getenv("DELETE_CONCURRENCY", "5"))  # parallel deletes when batch deletion is unavailable
+DELETE_RETRIES = 2  # extra attempts for messages that failed to delete
+LEADERBOARD_SYNC_INTERVAL = int(os.getenv("LEADERBOARD_SYNC_INTERVAL", "30"))  # seconds between shared leaderboard refreshes
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.db")  # SQLite file keeping scheduled jobs across restarts
+JOB_MISFIRE_GRACE = int(os.getenv("JOB_MISFIRE_GRACE", "300"))  # seconds a stored job may run late after a restart
+QUIZ_DB_PATH = os.getenv("QUIZ_DB_PATH", "quiz.db")  # SQLite file for questions, leaderboard rows and answer history
+QUESTION_CACHE_DIR = os.getenv("QUESTION_CACHE_DIR", "question_cache")  # Last fetched question banks with their ETags
+QUESTION_SYNC_INTERVAL = int(os.getenv("QUESTION_SYNC_INTERVAL", "3600"))  # seconds between question bank checks
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "1.0"))  # seconds of event loop lag that count as degraded
+HEALTH_MAX_SAVE_AGE = int(os.getenv("HEALTH_MAX_SAVE_AGE", "600"))  # seconds unsaved leaderboard changes may wait
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.25"))  # seconds the event loop may block before its stack is captured
+SLOW_HANDLER_THRESHOLD = float(os.getenv("SLOW_HANDLER_THRESHOLD", "1.0"))  # seconds before a handler or job is logged as slow
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))  # longest /profile window
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "journal.jsonl")  # Local journal of scores and used questions
+JOURNAL_FSYNC_MS = int(os.getenv("JOURNAL_FSYNC_MS", "20"))  # journal appends are fsynced together this often
+JOURNAL_COMPACT_EVENTS = int(os.getenv("JOURNAL_COMPACT_EVENTS", "1000"))  # events between journal compactions
 
 # Global variables
+PROCESS_START = time.monotonic()
+startup_timings = {}  # Startup phase name -> seconds
+data_ready = asyncio.Event()  # Set once the startup data load has finished
+leaderboard_loaded = asyncio.Event()  # Set only when the stored leaderboard (or its local copy) was loaded
+startup_task = None
+background_tasks = set()  # Keeps fire-and-forget tasks alive until they finish
 questions = []
 leaderboard = {}
-current_question = None
-current_message_id = None
 user_answers = {}
-answered_users = set()
 used_weekly_questions = set()
 used_daily_questions = set()  # Track used daily questions
-next_daily_question_index = 0  # Index for the next daily question
-next_weekly_question_index = 0  # Index for the next weekly question
+
+class Metrics:
+    """Counters, latency histograms and gauges rendered in the Prometheus text format"""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    RECENT = 1024  # Latest observations kept per histogram for exact percentiles
+
+    def __init__(self):
+        self.counters = collections.defaultdict(float)  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [per-bucket counts incl. +Inf, sum]
+        self.recent = {}  # (name, labels) -> deque of the latest observations
+        self.gauges = {}  # name -> callable returning the current value
+
+    def inc(self, name, labels=(), value=1):
+        self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, seconds):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = [[0] * (len(self.BUCKETS) + 1), 0.0]
+            self.recent[(name, labels)] = collections.deque(maxlen=self.RECENT)
+        histogram[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+        self.recent[(name, labels)].append(seconds)
+
+    def percentiles(self, name, quantiles=(0.5, 0.95, 0.99)):
+        """Per label set of a histogram: (total count, [quantile values]) over its latest observations"""
+        result = {}
+        for (histogram_name, labels), samples in self.recent.items():
+            if histogram_name != name or not samples:
+                continue
+            ordered = sorted(samples)
+            result[labels] = (sum(self.histograms[(name, labels)][0]),
+                              [ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles])
+        return result
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    @staticmethod
+    def _labels(labels):
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+    def render(self):
+        lines = []
+        for name, read in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {read()}")
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (counts, total) in sorted(self.histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def timed(function, metric, kind, on_success=None):
+    """Wrap a coroutine function so every call lands in <metric>_duration_seconds and <metric>_calls_total"""
+    labels = ((kind, function.__name__),)
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await function(*args, **kwargs)
+            outcome = "ok"
+            if on_success:
+                on_success()
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.observe(f"{metric}_duration_seconds", labels, elapsed)
+            metrics.inc(f"{metric}_calls_total", labels + (("outcome", outcome),))
+            if elapsed > SLOW_HANDLER_THRESHOLD:
+                logger.warning(f"Slow {kind} {function.__name__}: {elapsed:.2f}s ({outcome})")
+    return wrapper
+
+def instrumented(function):
+    """Record latency and outcome of an update handler; a success counts as the bot being alive"""
+    return timed(function, "quizbot_handler", "handler", on_success=lambda: setattr(health, "last_update_at", time.time()))
+
+def outbound(function):
+    """Record latency and outcome of an outbound call such as a GitHub upload"""
+    return timed(function, "quizbot_outbound", "call")
+
+def format_stack(frame, limit=12):
+    return "".join(traceback.format_stack(frame, limit=limit)) if frame else "<no frame>\n"
+
+class LoopWatchdog:
+    """Thread that notices when the event loop stops turning and logs the stack that is holding it"""
+    CHECK_INTERVAL = 0.1
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.loop = None
+        self.loop_thread_id = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.stalls = collections.deque(maxlen=10)  # (wall time, seconds blocked, stack)
+        self.lag = 0.0  # Seconds the latest check waited for the loop to run its callback
+        self.max_lag = 0.0  # Worst since the last health check
+
+    def start(self, loop):
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=1)
+
+    def _watch(self):
+        while not self.stopped.wait(self.CHECK_INTERVAL):
+            turned = threading.Event()
+            started = time.monotonic()
+            try:
+                self.loop.call_soon_threadsafe(turned.set)
+            except RuntimeError:
+                return  # Loop closed
+            if turned.wait(self.threshold):
+                self._lagged(time.monotonic() - started)
+                continue
+            # Capture while the loop is still stuck so the stack shows the blocking call
+            stack = format_stack(sys._current_frames().get(self.loop_thread_id))
+            while not turned.wait(self.threshold) and not self.stopped.is_set():
+                pass
+            blocked = time.monotonic() - started
+            self._lagged(blocked)
+            logger.warning(f"Event loop blocked for {blocked:.2f}s at:\n{stack}")
+            try:
+                self.loop.call_soon_threadsafe(self._record, time.time(), blocked, stack)
+            except RuntimeError:
+                return
+
+    def _lagged(self, lag):
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+
+    def _record(self, when, blocked, stack):
+        self.stalls.append((when, blocked, stack))
+        metrics.inc("quizbot_loop_stalls_total")
+        metrics.observe("quizbot_loop_stall_seconds", (), blocked)
+
+loop_watchdog = LoopWatchdog(LOOP_STALL_THRESHOLD)
+
+class SamplingProfiler:
+    """Wall-clock sampling of the event loop thread via SIGALRM; the loop must run on the main thread"""
+    INTERVAL = 0.005
+    IDLE_FRAMES = {"select", "poll", "epoll", "kqueue"}  # Leaf of an idle loop waiting in its selector
+
+    def __init__(self):
+        self.running = False
+        self.previous_handler = None
+        self.samples = self.idle = 0
+        self.self_counts = collections.Counter()  # Innermost frame
+        self.inclusive_counts = collections.Counter()  # Any bot.py function on the stack
+
+    def start(self):
+        self.samples = self.idle = 0
+        self.self_counts.clear()
+        self.inclusive_counts.clear()
+        self.previous_handler = signal.signal(signal.SIGALRM, self._sample)
+        signal.setitimer(signal.ITIMER_REAL, self.INTERVAL, self.INTERVAL)
+        self.running = True
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self.previous_handler)
+        self.running = False
+
+    def _sample(self, signum, frame):
+        self.samples += 1
+        if frame is None or frame.f_code.co_name in self.IDLE_FRAMES:
+            self.idle += 1
+            return
+        self.self_counts[f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"] += 1
+        seen = set()
+        while frame is not None:
+            if frame.f_code.co_filename == __file__ and frame.f_code.co_name not in seen:
+                seen.add(frame.f_code.co_name)
+                self.inclusive_counts[frame.f_code.co_name] += 1
+            frame = frame.f_back
+
+profiler = SamplingProfiler()
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest recording the latency and outcome of every Bot API call"""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        labels = (("method", url.rsplit("/", 1)[-1]),)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            outcome = "ok" if status < 400 else "flood_wait" if status == 429 else "error"
+            return status, payload
+        finally:
+            metrics.observe("quizbot_bot_api_duration_seconds", labels, time.perf_counter() - started)
+            metrics.inc("quizbot_bot_api_calls_total", labels + (("outcome", outcome),))
+
+class CompiledQuestion:
+    """A daily question prepared once, when first posted: keyboard built, answer as an option index"""
+    __slots__ = ("id", "text", "options", "correct_index", "explanation", "reply_markup", "raw")
+
+    def __init__(self, question):
+        self.id = question.get("id")
+        self.text = question.get("question")
+        self.options = question.get("options", [])
+        correct = question.get("correct_option", "").strip()
+        self.correct_index = next((index for index, option in enumerate(self.options) if option.strip() == correct), -1)
+        self.explanation = question.get("explanation", "No explanation provided.")
+        # Index callback data stays well inside Telegram's 64-byte limit whatever the option text
+        self.reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton(option, callback_data=f"answer_{index}")] for index, option in enumerate(self.options)
+        ])
+        self.raw = question
+
+    @property
+    def correct_option(self):
+        return self.options[self.correct_index] if self.correct_index >= 0 else self.raw.get("correct_option")
+
+    def is_correct(self, data):
+        """Check answer callback data: an option index, or option text from buttons posted before indexes"""
+        choice = data[7:]  # after "answer_"
+        if choice.isdigit():
+            return int(choice) == self.correct_index
+        return choice.strip() == self.raw.get("correct_option", "").strip()
+
+compiled_questions = []  # CompiledQuestion for each entry of questions, None until first needed
+question_positions = {}  # question id -> index in questions
+
+def compiled_question(position):
+    """CompiledQuestion for questions[position], built the first time it is posted"""
+    compiled = compiled_questions[position]
+    if compiled is None:
+        compiled = compiled_questions[position] = CompiledQuestion(questions[position])
+    return compiled
+
+def compile_question(question):
+    """Compiled form of a question dict, reusing the cached one when it matches"""
+    position = question_positions.get(question.get("id"))
+    if position is not None and questions[position] == question:
+        return compiled_question(position)
+    return CompiledQuestion(question)
+
+def recompile_questions(merged):
+    """Line compiled_questions up with a merged question list, keeping records whose question is unchanged"""
+    previous = {compiled.id: compiled for compiled in compiled_questions if compiled is not None}
+    compiled_questions[:] = [None] * len(merged)
+    question_positions.clear()
+    for position, question in enumerate(merged):
+        question_positions[question.get("id")] = position
+        compiled = previous.get(question.get("id"))
+        if compiled is not None and compiled.raw == question:
+            compiled_questions[position] = compiled
+
+class QuizSession:
+    """Daily challenge state for one channel; answered users live in the state backend"""
+    __slots__ = ("chat_id", "current_question", "current_message_id")
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.current_question = None
+        self.current_message_id = None
+
+    @property
+    def answers_key(self):
+        return f"daily:{self.chat_id}"
+
+quiz_sessions = {}  # chat_id -> QuizSession
+
+def get_quiz_session(chat_id):
+    session = quiz_sessions.get(chat_id)
+    if session is None:
+        session = quiz_sessions[chat_id] = QuizSession(chat_id)
+    return session
+
+async def load_quiz_session(chat_id):
+    """Local quiz session, refreshed from the state backend when it is shared between workers"""
+    session = get_quiz_session(chat_id)
+    if state_backend.shared:
+        state = await state_backend.get_value(f"session:{chat_id}")
+        if state:
+            session.current_question = compile_question(state["question"])
+            session.current_message_id = state["message_id"]
+    return session
+
+async def save_quiz_session(session):
+    if state_backend.shared:
+        await state_backend.set_value(f"session:{session.chat_id}", {
+            "question": session.current_question.raw,
+            "message_id": session.current_message_id,
+        })
+
+class HttpClient:
+    """Shared, pooled aiohttp session owned by the application for its whole lifetime"""
+    def __init__(self, timeout, max_connections):
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.session = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, url, **kwargs):
+        """Perform a request and return (status, body text)"""
+        async with self.semaphore:
+            async with self.session.request(method, url, **kwargs) as response:
+                return response.status, await response.text()
+
+    async def fetch_text(self, url, **kwargs):
+        """GET a URL and return its body, raising on HTTP errors"""
+        async with self.semaphore:
+            async with self.session.get(url, **kwargs) as response:
+                if DEBUG:
+                    logger.info(f"GET {url}: HTTP {response.status}")
+                response.raise_for_status()
+                return await response.text()
+
+    async def download_if_changed(self, url, path, etag=None, last_modified=None):
+        """Conditional GET streamed to path; return (status, ETag, Last-Modified)"""
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        async with self.semaphore:
+            async with self.session.get(url, headers=headers) as response:
+                if DEBUG:
+                    logger.info(f"GET {url}: HTTP {response.status}")
+                if response.status == 200:
+                    with open(path, "wb") as f:
+                        async for chunk in response.content.iter_chunked(65536):
+                            f.write(chunk)
+                return response.status, response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+http_client = HttpClient(HTTP_TIMEOUT, HTTP_MAX_CONNECTIONS)
+
+async def iter_json_array(chunks):
+    """Yield the elements of a top-level JSON array as its bytes arrive in chunks"""
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    opened = False
+    async for chunk in chunks:
+        buffer = buffer[position:] + text.decode(chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position == len(buffer):
+                break
+            if not opened:
+                if buffer[position] != "[":
+                    raise ValueError("Question bank is not a JSON array")
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break  # The element continues in the next chunk
+            if end == len(buffer) and not isinstance(item, (dict, list)):
+                break  # A number may be cut off mid-way
+            yield item
+            position = end
+    raise ValueError("Question bank ended before the closing ]")
+
+def question_error(question, kind):
+    """Why a question record is unusable, or None if it is fine"""
+    if not isinstance(question, dict):
+        return "not an object"
+    if not isinstance(question.get("question"), str) or not question["question"].strip():
+        return "missing question text"
+    options = question.get("options")
+    if not isinstance(options, list) or len(options) < 2 or not all(isinstance(option, str) for option in options):
+        return "needs at least two text options"
+    correct = question.get("correct_option")
+    if kind == "weekly":
+        # Polls take the index of the right option
+        if not isinstance(correct, int) or not 0 <= correct < len(options):
+            return "correct_option must be an option index"
+    elif correct not in options:
+        return "correct_option must be one of the options"
+    return None
+
+class QuestionBank:
+    """A remote question file mirrored on disk and kept fresh with conditional GETs.
+
+    The body is streamed to the cache as it downloads and read back one
+    question at a time, so a large bank is never held in memory whole. The
+    ETag and Last-Modified are cached too, so an unchanged file costs one 304
+    even after a restart.
+    """
+    def __init__(self, name, url, cache_dir):
+        self.name = name
+        self.url = url
+        self.cache_path = os.path.join(cache_dir, f"{name}.json")
+        self.meta_path = os.path.join(cache_dir, f"{name}.meta.json")
+        self.etag = None
+        self.last_modified = None
+        self.meta_loaded = False
+
+    def _load_meta(self):
+        self.meta_loaded = True
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if os.path.exists(self.cache_path):
+                self.etag, self.last_modified = meta["etag"], meta["last_modified"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Ignoring unreadable {self.name} question cache metadata: {e}")
+
+    async def refresh(self):
+        """Download the bank if it changed; True when the cached copy was replaced"""
+        if not self.meta_loaded:
+            self._load_meta()
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        temporary = self.cache_path + ".tmp"
+        try:
+            status, etag, last_modified = await http_client.download_if_changed(self.url, temporary, self.etag, self.last_modified)
+            if status >= 400:
+                raise RuntimeError(f"HTTP {status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+            if not os.path.exists(self.cache_path):
+                raise
+            logger.error(f"Error fetching {self.name} questions from {self.url}: {e}; using the cached copy")
+            return False
+        if status == 304:
+            logger.info(f"{self.name} questions unchanged")
+            return False
+        os.replace(temporary, self.cache_path)
+        self.etag, self.last_modified = etag, last_modified
+        with open(self.meta_path, "w") as f:
+            json.dump({"etag": etag, "last_modified": last_modified}, f)
+        return True
+
+    async def _read_cache(self):
+        with open(self.cache_path, "rb") as f:
+            while chunk := f.read(65536):
+                yield chunk
+
+    async def iter_questions(self):
+        """Yield valid questions from the cached bank, skipping and logging bad records"""
+        position = -1
+        async for question in iter_json_array(self._read_cache()):
+            position += 1
+            error = question_error(question, self.name)
+            if error:
+                logger.warning(f"Skipping {self.name} question #{position} ({question.get('id') if isinstance(question, dict) else None}): {error}")
+                continue
+            yield question
+
+async def merge_questions(known, fetched):
+    """Update known questions in place and append new ones by id; return how many were added"""
+    key = lambda question: question.get("id", question.get("question"))
+    positions = {key(question): position for position, question in enumerate(known)}
+    added = 0
+    async for question in fetched:
+        position = positions.get(key(question))
+        if position is None:
+            positions[key(question)] = len(known)
+            known.append(question)
+            added += 1
+        else:
+            known[position] = question
+    return added
+
+daily_bank = QuestionBank("daily", QUESTIONS_JSON_URL, QUESTION_CACHE_DIR)
+weekly_bank = QuestionBank("weekly", WEEKLY_QUESTIONS_JSON_URL, QUESTION_CACHE_DIR)
+
+class MemoryStateBackend:
+    """Process-local state; correct for a single worker"""
+    shared = False
+
+    def __init__(self):
+        self.players = {}
+        self.answered = {}  # key -> set of user ids
+        self.claims = {}  # key -> user id
+        self.cursors = {}
+        self.participants = {}  # key -> {user_id: {"name", "score"}}
+        self.values = {}
+
+    async def close(self):
+        pass
+
+    async def seed_players(self, players):
+        """Use a freshly loaded leaderboard and return the authoritative one"""
+        self.players = players
+        return self.players
+
+    async def get_players(self):
+        return self.players
+
+    async def add_scores(self, deltas):
+        """Apply (user_id, username, score, correct, total) deltas; return the updated players"""
+        updated = {}
+        for user_id, username, score, correct, total in deltas:
+            player = self.players.get(user_id)
+            if player is None:
+                player = self.players[user_id] = {"username": username, "score": 0, "total_answers": 0, "correct_answers": 0}
+            player["score"] = player.get("score", 0) + score
+            player["correct_answers"] = player.get("correct_answers", 0) + correct
+            player["total_answers"] = player.get("total_answers", 0) + total
+            updated[user_id] = player
+        return updated
+
+    async def reset_scores(self):
+        for player in self.players.values():
+            player["score"] = 0
+            player["total_answers"] = 0
+            player["correct_answers"] = 0
+        return self.players
+
+    async def first_answer(self, key, user_id):
+        """Record an answer; True only for the user's first answer under key"""
+        answered = self.answered.setdefault(key, set())
+        if user_id in answered:
+            return False
+        answered.add(user_id)
+        return True
+
+    async def claim(self, key, user_id):
+        """True only for the first user to claim key"""
+        return self.claims.setdefault(key, user_id) == user_id
+
+    async def clear_answers(self, key):
+        self.answered.pop(key, None)
+        self.claims.pop(key, None)
+
+    async def init_cursor(self, name, value=0):
+        self.cursors.setdefault(name, value)
+
+    async def next_cursor(self, name):
+        """Claim the current cursor position and advance it"""
+        position = self.cursors.get(name, 0)
+        self.cursors[name] = position + 1
+        return position
+
+    async def add_participant_points(self, key, entries):
+        """Add one point per (user_id, name) entry"""
+        participants = self.participants.setdefault(key, {})
+        for user_id, name in entries:
+            participant = participants.setdefault(str(user_id), {"name": name, "score": 0})
+            participant["score"] += 1
+
+    async def get_participants(self, key):
+        return dict(self.participants.get(key, {}))
+
+    async def clear_participants(self, key):
+        self.participants.pop(key, None)
+
+    async def get_value(self, key):
+        return self.values.get(key)
+
+    async def set_value(self, key, value):
+        self.values[key] = value
+
+class RedisStateBackend:
+    """State shared between workers through any Redis-protocol server"""
+    shared = True
+    ANSWER_TTL = 2 * 24 * 3600  # seconds to keep per-question answer sets
+
+    def __init__(self, url, prefix="quizbot"):
+        import redis.asyncio as redis  # Only needed when STATE_BACKEND_URL is set
+        self.client = redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def key(self, *parts):
+        return ":".join((self.prefix,) + tuple(str(part) for part in parts))
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def seed_players(self, players):
+        # Only the first worker to start seeds Redis; everyone else reads what is there
+        if await self.client.set(self.key("seeded"), 1, nx=True):
+            pipe = self.client.pipeline(transaction=True)
+            for user_id, player in players.items():
+                pipe.sadd(self.key("players"), user_id)
+                pipe.hset(self.key("player", user_id), mapping=player)
+            await pipe.execute()
+        return await self.get_players()
+
+    async def get_players(self):
+        user_ids = list(await self.client.smembers(self.key("players")))
+        players = {}
+        for start in range(0, len(user_ids), 1000):
+            chunk = user_ids[start:start + 1000]
+            pipe = self.client.pipeline(transaction=False)
+            for user_id in chunk:
+                pipe.hgetall(self.key("player", user_id))
+            for user_id, fields in zip(chunk, await pipe.execute()):
+                players[user_id] = self._player(user_id, fields)
+        return players
+
+    @staticmethod
+    def _player(user_id, fields):
+        return {
+            "username": fields.get("username", f"User {user_id}"),
+            "score": int(fields.get("score", 0)),
+            "total_answers": int(fields.get("total_answers", 0)),
+            "correct_answers": int(fields.get("correct_answers", 0)),
+        }
+
+    async def add_scores(self, deltas):
+        pipe = self.client.pipeline(transaction=True)
+        for user_id, username, score, correct, total in deltas:
+            key = self.key("player", user_id)
+            pipe.sadd(self.key("players"), user_id)
+            pipe.hsetnx(key, "username", username)
+            pipe.hincrby(key, "score", score)
+            pipe.hincrby(key, "correct_answers", correct)
+            pipe.hincrby(key, "total_answers", total)
+            pipe.hgetall(key)
+        results = await pipe.execute()
+        return {
+            delta[0]: self._player(delta[0], results[i * 6 + 5])
+            for i, delta in enumerate(deltas)
+        }
+
+    async def reset_scores(self):
+        pipe = self.client.pipeline(transaction=True)
+        for user_id in await self.client.smembers(self.key("players")):
+            pipe.hset(self.key("player", user_id), mapping={"score": 0, "total_answers": 0, "correct_answers": 0})
+        await pipe.execute()
+        return await self.get_players()
+
+    async def first_answer(self, key, user_id):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.sadd(self.key("answered", key), user_id)
+        pipe.expire(self.key("answered", key), self.ANSWER_TTL)
+        added, _ = await pipe.execute()
+        return added == 1
+
+    async def claim(self, key, user_id):
+        if await self.client.set(self.key("claim", key), user_id, nx=True, ex=self.ANSWER_TTL):
+            return True
+        return await self.client.get(self.key("claim", key)) == str(user_id)  # The holder keeps its claim
+
+    async def clear_answers(self, key):
+        await self.client.delete(self.key("answered", key), self.key("claim", key))
+
+    async def init_cursor(self, name, value=0):
+        await self.client.set(self.key("cursor", name), value, nx=True)
+
+    async def next_cursor(self, name):
+        return await self.client.incr(self.key("cursor", name)) - 1
+
+    async def add_participant_points(self, key, entries):
+        pipe = self.client.pipeline(transaction=True)
+        for user_id, name in entries:
+            pipe.hsetnx(self.key("participants", key, "names"), user_id, name)
+            pipe.hincrby(self.key("participants", key, "scores"), user_id, 1)
+        await pipe.execute()
+
+    async def get_participants(self, key):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(self.key("participants", key, "names"))
+        pipe.hgetall(self.key("participants", key, "scores"))
+        names, scores = await pipe.execute()
+        return {user_id: {"name": names.get(user_id, f"User {user_id}"), "score": int(score)} for user_id, score in scores.items()}
+
+    async def clear_participants(self, key):
+        await self.client.delete(self.key("participants", key, "names"), self.key("participants", key, "scores"))
+
+    async def get_value(self, key):
+        value = await self.client.get(self.key("value", key))
+        return json.loads(value) if value is not None else None
+
+    async def set_value(self, key, value):
+        await self.client.set(self.key("value", key), json.dumps(value))
+
+state_backend = RedisStateBackend(STATE_BACKEND_URL) if STATE_BACKEND_URL else MemoryStateBackend()
+
+# Outbound Bot API priorities, lower is sent first
+PRIORITY_POLL = 0
+PRIORITY_MESSAGE = 1
+PRIORITY_EDIT = 2
+PRIORITY_DELETE = 3
+PRIORITY_BACKGROUND = 4
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class Outbox:
+    """Central outbound Bot API scheduler.
+
+    Calls are queued by priority and released through a global token bucket and
+    one bucket per chat (groups and channels are limited per minute, private
+    chats per second). A chat has at most one call in flight, so calls to it
+    complete in queue order. A 429 blocks that chat for retry_after and the call
+    is queued again in its old place.
+    """
+    MAX_RETRIES = 3
+
+    def __init__(self, global_rate, chat_rate, group_rate_per_minute):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate_per_minute = group_rate_per_minute
+        self.buckets = {}  # chat_id -> TokenBucket
+        self.queue = []  # heap of (priority, seq, enqueued, chat_id, call, future, attempt)
+        self.seq = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.worker = None
+        self.in_flight = set()
+        self.busy_chats = set()  # chats with a call in flight
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.max_depth = 0
+        self.latencies = collections.deque(maxlen=1000)  # seconds from enqueue to completion
+
+    def bucket(self, chat_id):
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            if chat_id is not None and chat_id < 0:
+                bucket = TokenBucket(self.group_rate_per_minute / 60, self.group_rate_per_minute)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_rate)
+            self.buckets[chat_id] = bucket
+        return bucket
+
+    def start(self):
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker:
+            self.worker.cancel()
+            self.worker = None
+        if self.in_flight:
+            await asyncio.gather(*self.in_flight, return_exceptions=True)
+        for item in self.queue:
+            if not item[5].done():
+                item[5].cancel()
+        self.queue.clear()
+
+    async def send(self, priority, method, *args, **kwargs):
+        """Queue a Bot API call such as bot.send_message and await its result"""
+        chat_id = kwargs.get("chat_id", args[0] if args else None)
+        future = asyncio.get_running_loop().create_future()
+        self._push(priority, time.monotonic(), chat_id, lambda: method(*args, **kwargs), future, 0)
+        return await future
+
+    def _push(self, priority, enqueued, chat_id, call, future, attempt, seq=None):
+        seq = next(self.seq) if seq is None else seq
+        heapq.heappush(self.queue, (priority, seq, enqueued, chat_id, call, future, attempt))
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            now = time.monotonic()
+            wait = self.global_bucket.wait_time(now)
+            if wait <= 0:
+                wait = self._release(now)
+            if wait > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _release(self, now):
+        """Start the highest priority call whose chat has capacity, or return how long to wait"""
+        wait = None
+        for item in sorted(self.queue):
+            if item[3] in self.busy_chats:
+                continue  # Its turn comes when the call ahead of it completes
+            chat_wait = self.bucket(item[3]).wait_time(now)
+            if chat_wait <= 0:
+                self.queue.remove(item)
+                heapq.heapify(self.queue)
+                self.global_bucket.take()
+                self.bucket(item[3]).take()
+                if item[3] is not None:
+                    self.busy_chats.add(item[3])
+                task = asyncio.create_task(self._deliver(item))
+                self.in_flight.add(task)
+                task.add_done_callback(self.in_flight.discard)
+                return 0
+            wait = chat_wait if wait is None else min(wait, chat_wait)
+        return 1.0 if wait is None else wait  # Every queued chat is busy; _deliver wakes the worker
+
+    async def _deliver(self, item):
+        try:
+            await self._attempt(item)
+        finally:
+            self.busy_chats.discard(item[3])
+            self.wakeup.set()
+
+    async def _attempt(self, item):
+        priority, seq, enqueued, chat_id, call, future, attempt = item
+        if future.done():
+            return
+        try:
+            result = await call()
+        except RetryAfter as e:
+            self.flood_waits += 1
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            logger.warning(f"Flood control for chat {chat_id}: retrying in {retry_after}s")
+            self.bucket(chat_id).blocked_until = time.monotonic() + retry_after
+            if attempt < self.MAX_RETRIES:
+                self._push(priority, enqueued, chat_id, call, future, attempt + 1, seq)
+                return
+            self.failed += 1
+            future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            future.set_exception(e)
+        else:
+            self.sent += 1
+            future.set_result(result)
+        self.latencies.append(time.monotonic() - enqueued)
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else 0
+        return (f"queue {len(self.queue)} (max {self.max_depth}), {self.sent} sent, {self.failed} failed, "
+                f"{self.flood_waits} flood waits, latency p50 {p50:.0f} ms / p99 {p99:.0f} ms")
+
+outbox = Outbox(OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_GROUP_RATE)
+
+class JobStore:
+    """One-off jobs and weekly test state kept in SQLite so a restart can resume them"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS jobs (name TEXT PRIMARY KEY, callback TEXT NOT NULL, run_at REAL NOT NULL, data TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS weekly_state (channel_id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def add(self, name, callback, run_at, data):
+        if self.conn:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)", (name, callback, run_at.timestamp(), json.dumps(data)))
+
+    def remove(self, name):
+        if self.conn:
+            with self.conn:
+                self.conn.execute("DELETE FROM jobs WHERE name = ?", (name,))
+
+    def jobs(self):
+        """(name, callback, run_at, data) for every stored job, earliest first"""
+        if not self.conn:
+            return []
+        rows = self.conn.execute("SELECT name, callback, run_at, data FROM jobs ORDER BY run_at").fetchall()
+        return [(name, callback, datetime.fromtimestamp(run_at, pytz.utc), json.loads(data)) for name, callback, run_at, data in rows]
+
+    def save_weekly_state(self, channel_id, state):
+        if self.conn:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO weekly_state VALUES (?, ?)", (channel_id, json.dumps(state)))
+
+    def weekly_states(self):
+        if not self.conn:
+            return {}
+        return {channel_id: json.loads(data) for channel_id, data in self.conn.execute("SELECT channel_id, data FROM weekly_state")}
+
+job_store = JobStore(JOB_STORE_PATH)
+
+STORED_JOBS = {}  # callback name -> async fn(context, data), filled in below the callbacks
+
+def schedule_job(job_queue, name, callback, run_at, data):
+    """Run a registered callback at run_at and remember it until it has run; replaces a pending job of that name"""
+    for job in job_queue.get_jobs_by_name(name):
+        job.schedule_removal()
+    job_store.add(name, callback, run_at, data)
+    job_queue.run_once(run_stored_job, max(run_at, datetime.now(pytz.utc)), data=(callback, data),
+                       chat_id=data.get("channel_id"), name=name)
+
+def cancel_job(job_queue, name):
+    job_store.remove(name)
+    for job in job_queue.get_jobs_by_name(name):
+        job.schedule_removal()
+
+async def run_stored_job(context: ContextTypes.DEFAULT_TYPE):
+    callback, data = context.job.data
+    job_store.remove(context.job.name)  # At most once: a crash mid-send must not post twice
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        await STORED_JOBS[callback](context, data)
+        outcome = "ok"
+    except Exception as e:
+        logger.error(f"Stored job {context.job.name} failed: {e}")
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("quizbot_job_duration_seconds", (("job", callback),), elapsed)
+        metrics.inc("quizbot_job_runs_total", (("job", callback), ("outcome", outcome)))
+        if elapsed > SLOW_HANDLER_THRESHOLD:
+            logger.warning(f"Slow job {context.job.name}: {elapsed:.2f}s ({outcome})")
+
+WEEKLY_TIMELINE_JOBS = ("weekly_question", "weekly_stop_poll", "weekly_results")
+
+def restore_jobs(job_queue):
+    """Put stored jobs back on the queue with their original deadlines.
+
+    Jobs overdue by up to JOB_MISFIRE_GRACE run now. Later than that, a daily
+    question is skipped and booked for its next slot, a teaser is dropped so the
+    next Friday gets scheduled, and a quiz under way has its remaining timeline
+    moved forward so the earliest missed step runs now with the spacing kept.
+    """
+    for channel_id, state in job_store.weekly_states().items():
+        get_weekly_test(channel_id).restore(state)
+    now = datetime.now(pytz.utc)
+    grace = timedelta(seconds=JOB_MISFIRE_GRACE)
+    stored = []
+    for name, callback, run_at, data in job_store.jobs():
+        if callback not in STORED_JOBS:
+            logger.error(f"Dropping stored job {name}: unknown callback {callback}")
+            job_store.remove(name)
+            continue
+        stored.append((name, callback, run_at, data))
+
+    # How far each channel's quiz timeline has to move; jobs come earliest first
+    shifts = {}
+    for name, callback, run_at, data in stored:
+        if callback in WEEKLY_TIMELINE_JOBS:
+            shifts.setdefault(data["channel_id"], now - run_at if now - run_at > grace else timedelta(0))
+    for channel_id, shift in shifts.items():
+        if shift:
+            weekly_test = get_weekly_test(channel_id)
+            if weekly_test.started_at:
+                weekly_test.started_at += shift
+            save_weekly_test(weekly_test)
+            logger.warning(f"Weekly quiz in {channel_id} was stalled for {shift}; moving its remaining steps forward")
+
+    restored = []
+    for name, callback, run_at, data in stored:
+        late = now - run_at
+        if callback == "daily_question" and late > grace:
+            logger.warning(f"Skipping daily question {name}, {late} late; booking its next slot")
+            schedule_job(job_queue, name, callback, next_local_time(data["hour"], data["minute"], "Asia/Gaza"), data)
+            restored.append((name, callback, data))
+            continue
+        if callback == "weekly_teaser" and late > grace:
+            logger.warning(f"Dropping weekly teaser {name}, {late} late")
+            job_store.remove(name)
+            continue
+        shift = shifts.get(data.get("channel_id")) if callback in WEEKLY_TIMELINE_JOBS else None
+        if shift:
+            run_at += shift
+            job_store.add(name, callback, run_at, data)
+        job_queue.run_once(run_stored_job, max(run_at, now), data=(callback, data), chat_id=data.get("channel_id"), name=name)
+        restored.append((name, callback, data))
+        logger.info(f"Restored job {name} due {run_at}" + (" (overdue, running now)" if run_at < now else ""))
+    return restored
+
+class QuizStore:
+    """Questions, leaderboard rows and answer history in SQLite.
+
+    Question ids are stored JSON-encoded so they come back with their original
+    type. Runs in WAL mode without a sync per commit; the journal is what makes
+    scores crash-safe. Bulk writes run in a worker thread (asyncio.to_thread), so
+    every method holds the lock while it uses the connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS questions (id TEXT NOT NULL, type TEXT NOT NULL, position INTEGER NOT NULL, "
+                              "payload TEXT NOT NULL, used_at REAL, PRIMARY KEY (type, id))")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS questions_unused ON questions (type, used_at, position)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS leaderboard (user_id TEXT PRIMARY KEY, username TEXT NOT NULL, "
+                              "score INTEGER NOT NULL, correct_answers INTEGER NOT NULL, total_answers INTEGER NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS leaderboard_score ON leaderboard (score DESC)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS answer_history (user_id TEXT NOT NULL, question_id TEXT, chat_id INTEGER, "
+                              "correct INTEGER NOT NULL, answered_at REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS answer_history_user ON answer_history (user_id, answered_at)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def close(self):
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+
+    def save_questions(self, kind, items, start=0):
+        """Store fetched questions in order from position start, keeping when each was used"""
+        if not self.conn or not items:
+            return
+        rows = [(json.dumps(item.get("id", position)), kind, position, json.dumps(item)) for position, item in enumerate(items, start)]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO questions (id, type, position, payload) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (type, id) DO UPDATE SET position = excluded.position, payload = excluded.payload",
+                rows
+            )
+
+    def load_questions(self, kind):
+        if not self.conn:
+            return []
+        with self.lock:
+            return [json.loads(payload) for payload, in self.conn.execute(
+                "SELECT payload FROM questions WHERE type = ? ORDER BY position", (kind,))]
+
+    def count_questions(self, kind):
+        if not self.conn:
+            return 0
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM questions WHERE type = ?", (kind,)).fetchone()[0]
+
+    def first_unused(self, kind):
+        """Position of the first question of this kind that has not been used"""
+        if not self.conn:
+            return 0
+        with self.lock:
+            position, = self.conn.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM questions WHERE type = ? AND used_at IS NOT NULL", (kind,)
+            ).fetchone()
+            return position
+
+    def mark_used(self, kind, question_id):
+        if self.conn:
+            with self.lock, self.conn:
+                self.conn.execute("UPDATE questions SET used_at = ? WHERE type = ? AND id = ?", (time.time(), kind, json.dumps(question_id)))
+
+    def used_ids(self, kind):
+        if not self.conn:
+            return set()
+        with self.lock:
+            return {json.loads(id) for id, in self.conn.execute("SELECT id FROM questions WHERE type = ? AND used_at IS NOT NULL", (kind,))}
+
+    def save_players(self, players, complete=False):
+        """Upsert {user_id: player} rows; complete replaces the whole board with a fully loaded one"""
+        if not self.conn or not (players or complete):
+            return
+        with self.lock, self.conn:
+            if complete:
+                self.conn.execute("DELETE FROM leaderboard")
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('leaderboard_complete', '1')")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO leaderboard VALUES (?, ?, ?, ?, ?)",
+                [(user_id, player.get("username", f"User {user_id}"), player.get("score", 0),
+                  player.get("correct_answers", 0), player.get("total_answers", 0)) for user_id, player in players.items()]
+            )
+
+    def players_complete(self):
+        """True once the rows were seeded from a fully loaded leaderboard, not just the players who answered"""
+        if not self.conn:
+            return False
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM meta WHERE key = 'leaderboard_complete'").fetchone() is not None
+
+    def get_players(self):
+        if not self.conn:
+            return {}
+        with self.lock:
+            return {
+                user_id: {"username": username, "score": score, "total_answers": total, "correct_answers": correct}
+                for user_id, username, score, correct, total in self.conn.execute(
+                    "SELECT user_id, username, score, correct_answers, total_answers FROM leaderboard ORDER BY score DESC")
+            }
+
+    def add_answers(self, rows):
+        """Append (user_id, question_id, chat_id, correct) rows to the answer history"""
+        if not self.conn or not rows:
+            return
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO answer_history VALUES (?, ?, ?, ?, ?)",
+                [(user_id, json.dumps(question_id), chat_id, int(correct), now) for user_id, question_id, chat_id, correct in rows]
+            )
+
+quiz_store = QuizStore(QUIZ_DB_PATH)
+
+class StoreWriter:
+    """Apply quiz store writes in a worker thread one at a time, in the order they were queued.
+
+    Per-answer writes go through here so the event loop never waits on the
+    store lock while a bulk write holds it, and a later upsert can never land
+    before an earlier one.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.pending = collections.deque()  # (method name, args, future)
+        self.task = None
+
+    def submit(self, method, *args):
+        """Queue store.<method>(*args); the returned future resolves once it ran, even if it failed"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((method, args, future))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._drain())
+        return future
+
+    async def _drain(self):
+        while self.pending:
+            method, args, future = self.pending.popleft()
+            try:
+                await asyncio.to_thread(getattr(self.store, method), *args)
+            except Exception as e:
+                logger.error(f"Error running {method} on the quiz store: {e}")
+            if not future.done():
+                future.set_result(None)
+
+    async def close(self):
+        if self.task:
+            await self.task
+
+store_writer = StoreWriter(quiz_store)
 
 # Load Questions from URL
 DEBUG = True  # Set to True for extra debugging
 
-def load_questions():
-    global questions, used_daily_questions, next_daily_question_index
+async def load_questions():
+    global questions
     try:
         if DEBUG:
             logger.info(f"Attempting to load questions from {QUESTIONS_JSON_URL}")
-        response = requests.get(QUESTIONS_JSON_URL)
-        if DEBUG:
-            logger.info(f"Response status: {response.status_code}")
-        response.raise_for_status()
-        questions = response.json()
-        used_daily_questions = set()  # Reset used daily questions when loading new questions
-        next_daily_question_index = 0  # Reset the index for daily questions
+        if await daily_bank.refresh() or not questions:
+            # Merge onto the order kept from earlier syncs so the daily cursor stays valid
+            merged = list(questions) or await asyncio.to_thread(quiz_store.load_questions, "daily")
+            added = await merge_questions(merged, daily_bank.iter_questions())
+            await asyncio.to_thread(quiz_store.save_questions, "daily", list(merged))
+            questions = merged
+            recompile_questions(merged)
+            logger.info(f"daily questions synced: {added} new, {len(questions)} total")
+        used_daily_questions.update(journal.used["daily"], await asyncio.to_thread(quiz_store.used_ids, "daily"))  # Questions posted before the last restart
+        # Carry on after the last posted question unless another worker already has a cursor
+        await state_backend.init_cursor("daily", await asyncio.to_thread(quiz_store.first_unused, "daily"))
         if DEBUG:
             logger.info(f"Questions loaded: {len(questions)}")
             if questions:
                 logger.info(f"First question sample: {json.dumps(questions[0])[:200]}...")
         logger.info(f"Loaded {len(questions)} questions from {QUESTIONS_JSON_URL}")
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Error fetching questions from {QUESTIONS_JSON_URL}: {e}")
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding JSON from {QUESTIONS_JSON_URL}: {e}")
-        if DEBUG:
-            try:
-                logger.error(f"Raw response: {response.text[:500]}...")
-            except:
-                pass
     except Exception as e:
         logger.error(f"Error loading questions: {e}")
 
-def load_leaderboard():
+async def load_leaderboard():
     global leaderboard
     try:
-        response = requests.get(LEADERBOARD_JSON_URL)
-        response.raise_for_status()
-        leaderboard = response.json()
-        
+        stored = json.loads(await http_client.fetch_text(LEADERBOARD_JSON_URL))
+
         # Ensure all required keys exist in each entry
-        for user_id, data in leaderboard.items():
+        for user_id, data in stored.items():
             if "username" not in data:
                 data["username"] = f"User {user_id}"
             if "score" not in data:
@@ -96,76 +1314,104 @@ def load_leaderboard():
                 data["total_answers"] = 0
             if "correct_answers" not in data:
                 data["correct_answers"] = 0
-                
+
+        leaderboard = await state_backend.seed_players(stored)
+        if journal.retained and not state_backend.shared:
+            # Scores recorded after the last GitHub save; Redis already holds them
+            leaderboard = await replay_journal(journal.retained)
+        ranking_index.rebuild(leaderboard)
+        await store_writer.submit("save_players", dict(leaderboard), True)
+        leaderboard_loaded.set()
         logger.info(f"Loaded leaderboard from {LEADERBOARD_JSON_URL}")
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Error fetching leaderboard from {LEADERBOARD_JSON_URL}: {e}")
+        # Rows upserted only for players who answered would overwrite the stored board when flushed
+        if not await asyncio.to_thread(quiz_store.players_complete):
+            logger.error("No complete local copy of the leaderboard; it stays unsaved until it can be fetched")
+        else:
+            # The local rows already include every journaled score
+            stored = await asyncio.to_thread(quiz_store.get_players)
+            leaderboard = await state_backend.seed_players(stored)
+            ranking_index.rebuild(leaderboard)
+            leaderboard_loaded.set()
+            logger.info(f"Using the {len(stored)} leaderboard rows kept locally")
     except json.JSONDecodeError:
         logger.error(f"Error decoding leaderboard from {LEADERBOARD_JSON_URL}")
     except Exception as e:
         logger.error(f"Error loading leaderboard: {e}")
 
-def load_weekly_questions():
-    global weekly_questions, used_weekly_questions, next_weekly_question_index
+async def replay_journal(events):
+    """Apply journaled score events on top of the loaded leaderboard"""
+    players = await state_backend.get_players()
+    changes = 0
+    for event in events:
+        if event["type"] == "reset":
+            players = await state_backend.reset_scores()
+        else:
+            await state_backend.add_scores(event["deltas"])
+        changes += len(event.get("deltas", ()))
+    leaderboard_writer.mark_dirty(max(changes, 1))
+    logger.info(f"Replayed {len(events)} journal events ({changes} score changes)")
+    return players
+
+async def store_weekly_questions():
+    """Copy the cached weekly bank into the store a batch at a time rather than holding it whole"""
+    count = 0
+    batch = []
+    async for question in weekly_bank.iter_questions():
+        batch.append(question)
+        if len(batch) == 500:
+            await asyncio.to_thread(quiz_store.save_questions, "weekly", batch, count)
+            count += len(batch)
+            batch = []
+    await asyncio.to_thread(quiz_store.save_questions, "weekly", batch, count)
+    logger.info(f"Loaded {count + len(batch)} weekly questions from {WEEKLY_QUESTIONS_JSON_URL}")
+
+async def load_weekly_questions():
     try:
-        response = requests.get(WEEKLY_QUESTIONS_JSON_URL)
-        response.raise_for_status()
-        weekly_questions = response.json()
-        used_weekly_questions = set()  # Reset used weekly questions when loading new questions
-        next_weekly_question_index = 0  # Reset the index for weekly questions
-        logger.info(f"Loaded {len(weekly_questions)} weekly questions from {WEEKLY_QUESTIONS_JSON_URL}")
-    except requests.exceptions.RequestException as e:
+        if await weekly_bank.refresh() or not await asyncio.to_thread(quiz_store.count_questions, "weekly"):
+            await store_weekly_questions()
+        used_weekly_questions.update(journal.used["weekly"], await asyncio.to_thread(quiz_store.used_ids, "weekly"))  # Questions asked before the last restart
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logger.error(f"Error fetching weekly questions from {WEEKLY_QUESTIONS_JSON_URL}: {e}")
     except json.JSONDecodeError:
         logger.error(f"Error decoding JSON from {WEEKLY_QUESTIONS_JSON_URL}")
     except Exception as e:
         logger.error(f"Error loading weekly questions: {e}")
 
-load_questions()
-load_leaderboard()
-load_weekly_questions()
-
-def save_questions():
-    try:
-        with open('questions.json', 'w') as f:
-            json.dump(questions, f, indent=4)
-        logger.info("Questions saved successfully.")
-    except Exception as e:
-        logger.error(f"Error saving questions: {e}")
-
 async def send_question(context: ContextTypes.DEFAULT_TYPE):
-    global current_question, answered_users, current_message_id, used_daily_questions, next_daily_question_index, questions
-    answered_users = set()
+    session = get_quiz_session(context.job.chat_id or CHANNEL_ID)
+    await data_ready.wait()
+    await state_backend.clear_answers(session.answers_key)
     if not questions:
         logger.error("send_question: No questions available")
         return
 
-    if next_daily_question_index >= len(questions):
+    question_index = await state_backend.next_cursor("daily")
+    if question_index >= len(questions):
         logger.error("send_question: No available questions left to post")
         return
 
-    current_question = questions[next_daily_question_index]
-    used_daily_questions.add(current_question["id"])
-    next_daily_question_index += 1
-
-    # Remove the question from the list and save
-    questions.pop(0)
-    save_questions()
-
-    keyboard = [[InlineKeyboardButton(option, callback_data=f"answer_{option}")] for option in current_question.get("options", [])]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    session.current_question = compiled_question(question_index)
+    session.current_message_id = None  # Taps on the previous question's keyboard no longer count
+    used_daily_questions.add(session.current_question.id)
+    store_writer.submit("mark_used", "daily", session.current_question.id)
+    await journal.record_used("daily", session.current_question.id)
 
     try:
-        message = await context.bot.send_message(
-            chat_id=CHANNEL_ID,
-            text=current_question.get("question"),
-            reply_markup=reply_markup,
+        message = await outbox.send(
+            PRIORITY_MESSAGE,
+            context.bot.send_message,
+            chat_id=session.chat_id,
+            text=session.current_question.text,
+            reply_markup=session.current_question.reply_markup,
             disable_web_page_preview=True,
             disable_notification=False,
         )
         if message and message.message_id:
-            current_message_id = message.message_id
-            logger.info("send_question: message sent successfully")
+            session.current_message_id = message.message_id
+            await save_quiz_session(session)
+            logger.info(f"send_question: message sent successfully to {session.chat_id}")
         else:
             logger.info("send_question: message sending failed")
 
@@ -173,151 +1419,722 @@ async def send_question(context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"send_question: Failed to send question: {e}")
 
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global answered_users, current_question, current_message_id, leaderboard
-
     query = update.callback_query
     user_id = query.from_user.id
     username = query.from_user.first_name
 
-    if current_question is None:
-        await query.answer("No active question at the moment.", show_alert=True)
+    await data_ready.wait()
+    session = await load_quiz_session(query.message.chat_id) if query.message else None
+    if session is None or session.current_question is None:
+        await reply_sender.send(query.answer("No active question at the moment.", show_alert=True))
         return
-
-    if user_id in answered_users:
-        await query.answer("You already answered this question.", show_alert=True)
+    if query.message.message_id != session.current_message_id:
+        # Callback data is only an option index, so a tap on an older question's keyboard must not be scored here
+        await reply_sender.send(query.answer("This question is closed.", show_alert=True))
         return
 
-    answered_users.add(user_id)
-    user_answer = query.data.replace("answer_", "").strip()
-    correct_answer = current_question.get("correct_option", "").strip()
-
-    logger.info(f"User answer: '{user_answer}'")
-    logger.info(f"Correct answer: '{correct_answer}'")
+    if not await state_backend.first_answer(session.answers_key, user_id):
+        await reply_sender.send(query.answer("You already answered this question.", show_alert=True))
+        return
 
-    correct = user_answer == correct_answer
+    current_question = session.current_question
+    correct = current_question.is_correct(query.data)
+    if DEBUG:
+        logger.info(f"Answer {query.data!r} from {user_id}: {'correct' if correct else 'wrong'}")
 
     if correct:
         await query.answer("Correct!")
-        if str(user_id) not in leaderboard:
-            leaderboard[str(user_id)] = {"username": username, "score": 0, "total_answers": 0, "correct_answers": 0}
-        leaderboard[str(user_id)]["score"] += 1
-        
-        # Check if correct_answers key exists before incrementing
-        if "correct_answers" not in leaderboard[str(user_id)]:
-            leaderboard[str(user_id)]["correct_answers"] = 0
-        leaderboard[str(user_id)]["correct_answers"] += 1
+        await answer_batcher.add_score(str(user_id), username, 1, 1, 1, (current_question.id, session.chat_id))
+
+        # Only the first correct answer (across all workers) announces the winner
+        if not await state_backend.claim(session.answers_key, user_id):
+            return
 
-        explanation = current_question.get("explanation", "No explanation provided.")
         edited_text = (
             "📝 Daily Challenge (Answered)\n\n"
-            f"Question: {current_question.get('question')}\n"
-            f"✅ Correct Answer: {current_question.get('correct_option')}\n"
-            f"ℹ️ Explanation: {explanation}\n\n"
+            f"Question: {current_question.text}\n"
+            f"✅ Correct Answer: {current_question.correct_option}\n"
+            f"ℹ️ Explanation: {current_question.explanation}\n\n"
             f"🏆 Winner: {username}"
         )
         try:
-            await context.bot.edit_message_text(
-                chat_id=CHANNEL_ID,
-                message_id=current_message_id,
+            await outbox.send(
+                PRIORITY_MESSAGE,
+                context.bot.edit_message_text,
+                chat_id=session.chat_id,
+                message_id=session.current_message_id,
                 text=edited_text,
                 reply_markup=None  # Remove the inline keyboard
             )
         except Exception as e:
             logger.error(f"Failed to edit message: {e}")
     else:
-        await query.answer("Incorrect.", show_alert=True)
+        await reply_sender.send(query.answer("Incorrect.", show_alert=True))
+        await answer_batcher.add_score(str(user_id), username, 0, 0, 1, (current_question.id, session.chat_id))
 
-    # Check if total_answers key exists before incrementing
-    if "total_answers" not in leaderboard[str(user_id)]:
-        leaderboard[str(user_id)]["total_answers"] = 0
-    leaderboard[str(user_id)]["total_answers"] += 1
-    
-    save_leaderboard()
+async def record_scores(deltas):
+    """Apply (user_id, username, score, correct, total) deltas through the state backend.
 
-def save_leaderboard():
+    Raises OSError, with nothing applied, when the deltas could not be journaled.
+    """
+    seq = await journal.record_scores(deltas)  # On disk before it counts
     try:
-        github_token = os.getenv("GITHUB_TOKEN")
-        repo_owner = "TegerPython"  # Replace with your GitHub username
-        repo_name = "bot_data"  # Replace with your repository name
-        file_path = "leaderboard.json"
-
-        # Get the current file's SHA for updating
-        get_file_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/contents/{file_path}"
-        headers = {"Authorization": f"token {github_token}", "Accept": "application/vnd.github.v3+json"}
-        get_response = requests.get(get_file_url, headers=headers)
-        get_response.raise_for_status()
-        sha = get_response.json()["sha"]
-
-        # Update the file
-        content = json.dumps(leaderboard, indent=4).encode("utf-8")
-        encoded_content = base64.b64encode(content).decode("utf-8")
-
-        update_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/contents/{file_path}"
-        data = {
-            "message": "Update leaderboard",
-            "content": encoded_content,
-            "sha": sha,
-            "branch": "main",  # Or your branch name
+        updated = await state_backend.add_scores(deltas)
+        for user_id, player in updated.items():
+            leaderboard[user_id] = player
+            ranking_index.update(user_id, player["score"])
+        store_writer.submit("save_players", {user_id: dict(player) for user_id, player in updated.items()})
+    finally:
+        journal.applied(seq)
+    leaderboard_writer.mark_dirty(len(deltas))
+
+class LimitedSender:
+    """Run outgoing replies with bounded concurrency"""
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+
+    async def send(self, coro):
+        async with self.semaphore:
+            try:
+                return await coro
+            except Exception as e:
+                logger.warning(f"Reply failed: {e}")
+
+reply_sender = LimitedSender(ANSWER_REPLY_CONCURRENCY)
+
+class AnswerBatcher:
+    """Buffer answer events for a short window and apply them to scores in bulk.
+
+    With a window of 0 every event is applied as it arrives (the per-update
+    path); either way the counters make the two modes comparable.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.score_deltas = []
+        self.participant_points = {}  # participants_key -> [(user_id, name)]
+        self.history = []  # (user_id, question_id, chat_id, correct)
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+        self.retry_delay = 0  # seconds added to the window while the journal cannot be written
+        self.started = time.monotonic()
+        self.events = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.apply_seconds = 0.0
+
+    async def add_score(self, user_id, username, score, correct, total, answered=None):
+        """answered is (question_id, chat_id) for an answer to keep in the history"""
+        self.score_deltas.append((user_id, username, score, correct, total))
+        if answered is not None:
+            self.history.append((user_id, answered[0], answered[1], correct))
+        await self._schedule()
+
+    async def add_participant_point(self, key, user_id, name):
+        self.participant_points.setdefault(key, []).append((user_id, name))
+        await self._schedule()
+
+    async def _schedule(self):
+        self.events += 1
+        if not self.window:
+            await self.flush()
+        elif self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Keep going while answers arrive during a flush
+        while self.score_deltas or self.participant_points:
+            await asyncio.sleep(self.window + self.retry_delay)
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            score_deltas, self.score_deltas = self.score_deltas, []
+            participant_points, self.participant_points = self.participant_points, {}
+            history, self.history = self.history, []
+            size = len(score_deltas) + sum(len(entries) for entries in participant_points.values())
+            if not size:
+                return
+            started = time.monotonic()
+            try:
+                if score_deltas:
+                    # Coalesce repeated players into one delta each
+                    merged = {}
+                    for user_id, username, score, correct, total in score_deltas:
+                        previous = merged.get(user_id)
+                        merged[user_id] = (user_id, username, score, correct, total) if previous is None else (
+                            user_id, previous[1], previous[2] + score, previous[3] + correct, previous[4] + total)
+                    try:
+                        await record_scores(list(merged.values()))
+                    except OSError as e:
+                        # Not journaled, so nothing was applied: keep the whole batch for a later flush
+                        self.score_deltas[:0] = merged.values()
+                        for key, entries in participant_points.items():
+                            self.participant_points.setdefault(key, [])[:0] = entries
+                        self.history[:0] = history
+                        self.retry_delay = min(max(self.retry_delay * 2, 1), 30)
+                        logger.error(f"Journal write failed, retrying {size} buffered answers in {self.retry_delay}s: {e}")
+                        if self.flush_task is None or self.flush_task.done():
+                            self.flush_task = asyncio.create_task(self._flush_later())
+                        return
+                    self.retry_delay = 0
+                for key, entries in participant_points.items():
+                    await state_backend.add_participant_points(key, entries)
+                store_writer.submit("add_answers", history)
+            except Exception as e:
+                logger.error(f"Error applying {size} buffered answers: {e}")
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, size)
+            self.apply_seconds += time.monotonic() - started
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        mode = f"batched ({self.window * 1000:.0f} ms)" if self.window else "per-update"
+        average = self.events / self.batches if self.batches else 0
+        apply_ms = self.apply_seconds * 1000 / self.events if self.events else 0
+        return (f"{mode}: {self.events} answers in {self.batches} batches "
+                f"(avg {average:.1f}, max {self.largest_batch}), "
+                f"{self.events / elapsed:.2f} answers/s, {apply_ms:.3f} ms apply per answer")
+
+answer_batcher = AnswerBatcher(ANSWER_BATCH_WINDOW_MS / 1000)
+
+@outbound
+async def save_leaderboard(content, sha=None):
+    """Write the leaderboard JSON to GitHub and return the new file SHA"""
+    github_token = os.getenv("GITHUB_TOKEN")
+    repo_owner = "TegerPython"  # Replace with your GitHub username
+    repo_name = "bot_data"  # Replace with your repository name
+    file_path = "leaderboard.json"
+
+    file_url = f"{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/contents/{file_path}"
+    headers = {"Authorization": f"token {github_token}", "Accept": "application/vnd.github.v3+json"}
+
+    # Only look up the SHA when we don't have one cached from the last write
+    cached = sha is not None
+    if not cached:
+        sha = json.loads(await http_client.fetch_text(file_url, headers=headers))["sha"]
+
+    encoded_content = base64.b64encode(content.encode("utf-8")).decode("utf-8")
+    data = {
+        "message": "Update leaderboard",
+        "content": encoded_content,
+        "sha": sha,
+        "branch": "main",  # Or your branch name
+    }
+    status, body = await http_client.request("PUT", file_url, json=data, headers=headers)
+    if cached and status in (409, 422):
+        # Cached SHA is stale (file changed elsewhere), refetch and retry once
+        return await save_leaderboard(content)
+    if status >= 400:
+        raise RuntimeError(f"GitHub responded with HTTP {status}: {body[:200]}")
+    return json.loads(body)["content"]["sha"]
+
+class LeaderboardWriter:
+    """Write-behind persistence: coalesce leaderboard changes into periodic GitHub commits"""
+    def __init__(self, interval, threshold):
+        self.interval = interval
+        self.threshold = threshold
+        self.pending = 0
+        self.sha = None
+        self.lock = asyncio.Lock()
+        self.flush_task = None
+        self.saved_at = time.monotonic()  # Last successful save, or startup
+
+    def mark_dirty(self, changes=1):
+        self.pending += changes
+        if self.pending >= self.threshold and (self.flush_task is None or self.flush_task.done()):
+            self.flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        async with self.lock:
+            # Never overwrite the stored leaderboard unless it was actually loaded;
+            # scores stay in the journal and local rows until a restart loads it
+            if not self.pending or not leaderboard_loaded.is_set():
+                return
+            pending = self.pending
+            self.pending = 0
+            # Snapshot now; changes made while the upload runs mark the leaderboard dirty again
+            upto = journal.durable_seq()
+            content = json.dumps(await state_backend.get_players(), indent=4)
+            try:
+                self.sha = await save_leaderboard(content, self.sha)
+                logger.info(f"Leaderboard saved successfully to GitHub ({pending} changes).")
+                self.saved_at = time.monotonic()
+            except Exception as e:
+                self.pending += pending
+                self.sha = None
+                logger.error(f"Error saving leaderboard to GitHub: {e}")
+                return
+            try:
+                await journal.checkpoint(upto)
+            except OSError as e:
+                # Saved all the same; the next checkpoint covers these events
+                logger.error(f"Error checkpointing journal: {e}")
+
+leaderboard_writer = LeaderboardWriter(LEADERBOARD_FLUSH_INTERVAL, LEADERBOARD_FLUSH_THRESHOLD)
+
+class Journal:
+    """Append-only JSONL journal of score changes and used questions.
+
+    Appends are group-committed: everything queued within one fsync interval
+    is written and fsynced together before the appenders resume. A checkpoint
+    records the last score event included in the GitHub leaderboard, and
+    replay on startup skips everything up to it.
+    """
+    def __init__(self, path, interval, compact_events):
+        self.path = path
+        self.interval = interval
+        self.compact_events = compact_events
+        self.file = None
+        self.seq = 0
+        self.written_seq = 0  # Highest seq written and fsynced; later ones are still in the buffer
+        self.checkpoint_seq = 0
+        self.used = {"daily": set(), "weekly": set()}
+        self.retained = []  # score and reset events after the checkpoint
+        self.in_flight = set()  # seqs journaled but not yet applied
+        self.buffer = []  # (event, line) waiting for the next write
+        self.waiters = []
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+        self.since_compaction = 0
+
+    def open(self):
+        """Load the journal, then rewrite it compacted (which also drops a torn last line)"""
+        retained = {}  # seq -> event; a compaction can leave an event in the file twice
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping unreadable journal line: {line[:80]!r}")
+                        continue
+                    self.seq = max(self.seq, event["seq"])
+                    if event["type"] == "checkpoint":
+                        self.checkpoint_seq = max(self.checkpoint_seq, event["upto"])
+                    elif event["type"] == "used":
+                        self.used[event["kind"]].update(event["ids"])
+                    else:
+                        retained[event["seq"]] = event
+        self.retained = [event for seq, event in sorted(retained.items()) if seq > self.checkpoint_seq]
+        self.written_seq = self.seq
+        self._compact()
+        logger.info(f"Journal opened: {len(self.retained)} score events to replay, "
+                    f"{len(self.used['daily'])} daily and {len(self.used['weekly'])} weekly questions used")
+
+    def _compact(self):
+        """Rewrite the journal as the checkpoint, the used questions and the events after it.
+
+        Events still in the buffer are left out; the next flush appends them to
+        the new file, and if that fails they must not be in it already.
+        """
+        events = [{"seq": self.checkpoint_seq, "type": "checkpoint", "upto": self.checkpoint_seq}]
+        for kind, ids in self.used.items():
+            events.append({"seq": self.written_seq, "type": "used", "kind": kind, "ids": sorted(ids, key=str)})
+        events.extend(event for event in self.retained if event["seq"] <= self.written_seq)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            f.writelines(json.dumps(event) + "\n" for event in events)
+            f.flush()
+            os.fsync(f.fileno())
+        if self.file:
+            self.file.close()
+        os.replace(temporary, self.path)
+        self.file = open(self.path, "a")
+        self.since_compaction = 0
+
+    async def append(self, event):
+        """Journal an event and return its seq once it is on disk; raises OSError if it could not be written"""
+        if self.file is None:
+            return None
+        self.seq += 1
+        event["seq"] = self.seq
+        if event["type"] == "used":
+            self.used[event["kind"]].update(event["ids"])
+        elif event["type"] != "checkpoint":
+            self.retained.append(event)
+            if event["type"] == "score":
+                self.in_flight.add(self.seq)  # Until applied() is called
+        self.buffer.append((event, json.dumps(event) + "\n"))
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+        await waiter
+        return event["seq"]
+
+    async def record_scores(self, deltas):
+        return await self.append({"type": "score", "deltas": deltas})
+
+    def applied(self, seq):
+        self.in_flight.discard(seq)
+
+    async def record_used(self, kind, question_id):
+        try:
+            await self.append({"type": "used", "kind": kind, "ids": [question_id]})
+        except OSError as e:
+            # The question was posted either way; the question store still marks it used
+            logger.error(f"Error journaling used {kind} question {question_id}: {e}")
+
+    async def _flush_later(self):
+        while self.buffer:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            entries, self.buffer = self.buffer, []
+            waiters, self.waiters = self.waiters, []
+            if not entries:
+                return
+            try:
+                await asyncio.to_thread(self._write, [line for _, line in entries])
+            except OSError as e:
+                logger.error(f"Error writing {len(entries)} journal events: {e}")
+                # None of them is on disk, so none of them may count
+                failed = {event["seq"] for event, _ in entries}
+                self.retained = [event for event in self.retained if event["seq"] not in failed]
+                self.in_flight -= failed
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                return
+            self.written_seq = entries[-1][0]["seq"]
+            self.since_compaction += len(entries)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _write(self, lines):
+        offset = self.file.tell()
+        try:
+            self.file.writelines(lines)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError:
+            # Cut off whatever part of the batch reached the file so a restart does not replay it
+            try:
+                self.file.truncate(offset)
+                self.file.seek(offset)
+            except OSError as e:
+                logger.error(f"Error truncating journal after a failed write: {e}")
+            raise
+
+    def durable_seq(self):
+        """Highest seq whose score events have all been applied"""
+        return min(self.in_flight) - 1 if self.in_flight else self.seq
+
+    async def checkpoint(self, upto):
+        """Record that every score event up to upto is in the stored leaderboard"""
+        if self.file is None or upto <= self.checkpoint_seq:
+            return
+        await self.append({"type": "checkpoint", "upto": upto})  # Only skip replaying what the file says is saved
+        self.checkpoint_seq = max(self.checkpoint_seq, upto)
+        self.retained = [event for event in self.retained if event["seq"] > upto]
+        if self.since_compaction >= self.compact_events:
+            async with self.lock:
+                await asyncio.to_thread(self._compact)
+
+    async def close(self):
+        await self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+journal = Journal(JOURNAL_PATH, JOURNAL_FSYNC_MS / 1000, JOURNAL_COMPACT_EVENTS)
+
+class RankingIndex:
+    """Order-statistics index over leaderboard scores.
+
+    A Fenwick tree counts players per score, so a player's rank (players with a
+    higher score + 1, ties share a rank) is an O(log n) prefix sum. Players are
+    bucketed by score so the top of the board is read without sorting.
+    """
+    def __init__(self):
+        self.rebuild({})
+
+    def rebuild(self, board):
+        self.scores = {}  # user_id -> score
+        self.buckets = {}  # score -> {user_id: None}, in arrival order
+        self.distinct = []  # distinct scores, ascending
+        self.tree = [0] * 65  # Fenwick tree over scores 0..63, grown on demand
+        self.version = getattr(self, "version", 0) + 1  # Bumped on every change
+        for user_id, player in board.items():
+            self.update(user_id, player.get("score", 0))
+
+    def __len__(self):
+        return len(self.scores)
+
+    def _add(self, score, delta):
+        i = score + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _count_upto(self, score):
+        """Number of players with a score <= score"""
+        total = 0
+        i = min(score + 1, len(self.tree) - 1)
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _grow(self, score):
+        size = len(self.tree) - 1
+        while size <= score:
+            size *= 2
+        self.tree = [0] * (size + 1)
+        for bucket_score, bucket in self.buckets.items():
+            self._add(bucket_score, len(bucket))
+
+    def update(self, user_id, score):
+        score = max(0, int(score))
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._discard(user_id, old)
+        if score >= len(self.tree) - 1:
+            self._grow(score)
+        bucket = self.buckets.get(score)
+        if bucket is None:
+            bucket = self.buckets[score] = {}
+            bisect.insort(self.distinct, score)
+        bucket[user_id] = None
+        self.scores[user_id] = score
+        self._add(score, 1)
+        self.version += 1
+
+    def _discard(self, user_id, score):
+        bucket = self.buckets[score]
+        del bucket[user_id]
+        if not bucket:
+            del self.buckets[score]
+            self.distinct.pop(bisect.bisect_left(self.distinct, score))
+        del self.scores[user_id]
+        self._add(score, -1)
+
+    def remove(self, user_id):
+        if user_id in self.scores:
+            self._discard(user_id, self.scores[user_id])
+            self.version += 1
+
+    def rank(self, user_id):
+        """1-based rank of a player, or None if they are not ranked"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return len(self.scores) - self._count_upto(score) + 1
+
+    def top(self, limit=None, offset=0):
+        """Yield (rank, user_id, score) from the top of the board"""
+        if limit is None:
+            limit = len(self.scores)
+        seen = 0
+        for score in reversed(self.distinct):
+            bucket = self.buckets[score]
+            if seen + len(bucket) <= offset:
+                seen += len(bucket)
+                continue
+            rank = len(self.scores) - self._count_upto(score) + 1
+            for user_id in itertools.islice(bucket, max(0, offset - seen), None):
+                if limit <= 0:
+                    return
+                yield rank, user_id, score
+                limit -= 1
+            seen += len(bucket)
+            offset = seen
+
+ranking_index = RankingIndex()
+leaderboard_page_cache = {}  # (title, page) -> rendered page, valid for leaderboard_page_version
+leaderboard_page_version = None
+
+async def flush_leaderboard(context: ContextTypes.DEFAULT_TYPE):
+    await leaderboard_writer.flush()
+
+async def sync_leaderboard(context: ContextTypes.DEFAULT_TYPE):
+    """Reload the local leaderboard view from the shared state backend"""
+    global leaderboard
+    if not data_ready.is_set():
+        return
+    try:
+        leaderboard = await state_backend.get_players()
+        ranking_index.rebuild(leaderboard)
+    except Exception as e:
+        logger.error(f"Error syncing leaderboard from state backend: {e}")
+
+async def sync_questions(context: ContextTypes.DEFAULT_TYPE):
+    """Merge new questions from both question banks"""
+    if not data_ready.is_set():
+        return
+    await asyncio.gather(load_questions(), load_weekly_questions())
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def timed_phase(name, coro):
+    """Await a startup phase and record how long it took"""
+    started = time.monotonic()
+    try:
+        return await coro
+    finally:
+        startup_timings[name] = time.monotonic() - started
+
+async def load_bot_data():
+    """Fetch questions, leaderboard and weekly questions concurrently"""
+    try:
+        await timed_phase("data", asyncio.gather(
+            timed_phase("questions", load_questions()),
+            timed_phase("leaderboard", load_leaderboard()),
+            timed_phase("weekly_questions", load_weekly_questions()),
+        ))
+    finally:
+        data_ready.set()
+        startup_timings["ready"] = time.monotonic() - PROCESS_START
+        logger.info("Startup timings: " + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in startup_timings.items()))
+
+class HealthMonitor:
+    """Cheap local health: event loop lag, last handled update, scheduler and persistence backlog"""
+    FATAL = {"scheduler"}  # Problem codes that make /healthz answer 503
+
+    def __init__(self):
+        self.last_update_at = None  # Wall clock time of the last update handled without error
+        self.job_queue = None
+        self.reported = ("ok", ())  # Last status sent to the owners
+
+    def status(self):
+        """Health report; status is "degraded" with problem code -> description when a check fails"""
+        problems = {}
+        loop_lag = max(loop_watchdog.lag, loop_watchdog.max_lag)  # Measured by the watchdog thread
+        if loop_lag > HEALTH_MAX_LOOP_LAG:
+            problems["loop_lag"] = f"event loop lag {loop_lag:.2f}s"
+        if not data_ready.is_set():
+            problems["loading"] = "startup data still loading"
+        scheduler_running = bool(self.job_queue and self.job_queue.scheduler.running)
+        if SCHEDULER_ENABLED and not scheduler_running:
+            problems["scheduler"] = "scheduler not running"
+        unsaved_for = time.monotonic() - leaderboard_writer.saved_at
+        if leaderboard_writer.pending and unsaved_for > HEALTH_MAX_SAVE_AGE:
+            problems["unsaved"] = f"{leaderboard_writer.pending} leaderboard changes unsaved for {unsaved_for:.0f}s"
+        return {
+            "status": "degraded" if problems else "ok",
+            "problems": problems,
+            "loop_lag_ms": round(loop_watchdog.lag * 1000, 1),
+            "max_loop_lag_ms": round(loop_watchdog.max_lag * 1000, 1),
+            "last_update_at": datetime.fromtimestamp(self.last_update_at, pytz.utc).isoformat() if self.last_update_at else None,
+            "scheduler": {
+                "enabled": SCHEDULER_ENABLED,
+                "running": scheduler_running,
+                "jobs": len(self.job_queue.jobs()) if self.job_queue else 0,
+            },
+            "backlog": {
+                "leaderboard_changes": leaderboard_writer.pending,
+                "journal": len(journal.buffer),
+                "answers": len(answer_batcher.score_deltas),
+                "outbox": len(outbox.queue),
+            },
+            "uptime_seconds": round(time.monotonic() - PROCESS_START),
         }
-        update_response = requests.put(update_url, json=data, headers=headers)
-        update_response.raise_for_status()
 
-        logger.info("Leaderboard saved successfully to GitHub.")
-    except Exception as e:
-        logger.error(f"Error saving leaderboard to GitHub: {e}")
+health = HealthMonitor()
+
+async def check_health(context: ContextTypes.DEFAULT_TYPE):
+    """DM the owners only when the health status changes"""
+    report = health.status()
+    loop_watchdog.max_lag = 0.0
+    # Alert on which checks fail, not on the numbers in their descriptions
+    current = (report["status"], tuple(sorted(report["problems"])))
+    if current == health.reported:
+        return
+    health.reported = current
+    if report["status"] == "ok":
+        text = "✅ Bot health recovered"
+    else:
+        text = "⚠️ Bot health degraded:\n" + "\n".join(f"- {problem}" for problem in report["problems"].values())
+    for owner_id in (OWNER_ID, SECOND_OWNER):
+        try:
+            await outbox.send(PRIORITY_BACKGROUND, context.bot.send_message, chat_id=owner_id, text=text)
+        except Exception as e:
+            logger.error(f"Error sending health alert to {owner_id}: {e}")
+
+async def post_init(application: Application):
+    """Open the shared HTTP client and start loading data in the background"""
+    startup_timings["boot"] = time.monotonic() - PROCESS_START
+    await timed_phase("http_client", http_client.start())
+    journal.open()
+    quiz_store.open()
+    outbox.start()
+    health.job_queue = application.job_queue
+    loop_watchdog.start(asyncio.get_running_loop())
+    # Don't hold up webhook registration; handlers wait on data_ready instead
+    global startup_task
+    startup_task = asyncio.create_task(load_bot_data())
+
+async def post_shutdown(application: Application):
+    """Flush pending leaderboard changes and release the HTTP client"""
+    await answer_batcher.flush()
+    await leaderboard_writer.flush()
+    await journal.close()
+    if background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+    await outbox.stop()
+    loop_watchdog.stop()
+    await http_client.close()
+    await state_backend.close()
+    job_store.close()
+    await store_writer.close()
+    quiz_store.close()
 
 async def test_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID and update.effective_user.id != SECOND_OWNER:
         await update.message.reply_text("You are not authorized to use this command.")
         return
     
+    await data_ready.wait()
     if not questions:
         await update.message.reply_text("No questions loaded!")
         return
     
     # Ensure the current question is set properly
-    global current_question, current_message_id, answered_users, next_daily_question_index
-    answered_users = set()
-    if next_daily_question_index >= len(questions):
+    session = get_quiz_session(int(context.args[0]) if context.args else CHANNEL_ID)
+    await state_backend.clear_answers(session.answers_key)
+    question_index = await state_backend.next_cursor("daily")
+    if question_index >= len(questions):
         await update.message.reply_text("No available questions left to post")
         return
 
-    current_question = questions[next_daily_question_index]
-    used_daily_questions.add(current_question["id"])
-    next_daily_question_index += 1
-    
-    # Remove the question from the list and save
-    questions.pop(0)
-    save_questions()
+    current_question = session.current_question = compiled_question(question_index)
+    session.current_message_id = None
+    used_daily_questions.add(current_question.id)
+    store_writer.submit("mark_used", "daily", current_question.id)
+    await journal.record_used("daily", current_question.id)
 
     try:
-        keyboard = [[InlineKeyboardButton(option, callback_data=f"answer_{option}")] for option in current_question.get("options", [])]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        message = await context.bot.send_message(
-            chat_id=CHANNEL_ID,
-            text=current_question.get("question"),
-            reply_markup=reply_markup,
+        message = await outbox.send(
+            PRIORITY_MESSAGE,
+            context.bot.send_message,
+            chat_id=session.chat_id,
+            text=current_question.text,
+            reply_markup=current_question.reply_markup,
             disable_web_page_preview=True,
             disable_notification=False,
         )
         
         if message and message.message_id:
-            current_message_id = message.message_id
+            session.current_message_id = message.message_id
+            await save_quiz_session(session)
             logger.info("test_question: message sent successfully")
         else:
             logger.info("test_question: message sending failed")
 
-        await update.message.reply_text(f"Test question sent in channel. Question: {current_question.get('question')}")
+        await update.message.reply_text(f"Test question sent in channel. Question: {current_question.text}")
     except Exception as e:
         logger.error(f"test_question: Failed to send test question: {e}")
         await update.message.reply_text(f"Error: {str(e)}")
 
-async def heartbeat(context: ContextTypes.DEFAULT_TYPE):
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    await context.bot.send_message(chat_id=OWNER_ID, text=f"Heartbeat check - Bot is alive at {now}")
-    await context.bot.send_message(chat_id=SECOND_OWNER, text=f"Heartbeat check - Bot is alive at {now}")
-
 async def set_webhook(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_user.id != OWNER_ID and update.effective_user.id != SECOND_OWNER:
         await update.message.reply_text("You are not authorized to use this command.")
@@ -325,14 +2142,45 @@ async def set_webhook(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     await context.bot.set_webhook(f"{WEBHOOK_URL}/{BOT_TOKEN}")
     await update.message.reply_text("Webhook refreshed.")
 
+def render_leaderboard_page(title, page):
+    """Render one leaderboard page as (text, page, pages), cached until the scores change"""
+    global leaderboard_page_version
+    if leaderboard_page_version != ranking_index.version:
+        leaderboard_page_cache.clear()
+        leaderboard_page_version = ranking_index.version
+
+    pages = max(1, -(-len(ranking_index) // LEADERBOARD_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    key = (title, page)
+    if key not in leaderboard_page_cache:
+        lines = [f"{title} (page {page + 1}/{pages})", ""]
+        length = len(lines[0]) + 1
+        for rank, user_id, score in ranking_index.top(LEADERBOARD_PAGE_SIZE, page * LEADERBOARD_PAGE_SIZE):
+            line = f"{rank}. {leaderboard[user_id]['username'][:MAX_USERNAME_LENGTH]}: {score} points"
+            if length + len(line) + 1 > TELEGRAM_MESSAGE_LIMIT:
+                break
+            lines.append(line)
+            length += len(line) + 1
+        if len(lines) == 2:
+            lines.append("No players yet.")
+        leaderboard_page_cache[key] = ("\n".join(lines), page, pages)
+    return leaderboard_page_cache[key]
+
+def leaderboard_page_buttons(prefix, page, pages):
+    """Prev/next buttons for a leaderboard page, empty when there is only one page"""
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"{prefix}{page - 1}"))
+    if page + 1 < pages:
+        row.append(InlineKeyboardButton("Next ➡️", callback_data=f"{prefix}{page + 1}"))
+    return [row] if row else []
+
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await data_ready.wait()
     try:
-        logger.info(f"Leaderboard data: {leaderboard}")
-        sorted_leaderboard = sorted(leaderboard.items(), key=lambda item: item[1]["score"], reverse=True)
-        leaderboard_text = "🏆 Leaderboard 🏆\n\n"
-        for rank, (user_id, player) in enumerate(sorted_leaderboard, start=1):
-            leaderboard_text += f"{rank}. {player['username']}: {player['score']} points\n"
-        await update.message.reply_text(leaderboard_text)
+        leaderboard_text, page, pages = render_leaderboard_page("🏆 Leaderboard 🏆", 0)
+        buttons = leaderboard_page_buttons("leaderboard_page_", page, pages)
+        await update.message.reply_text(leaderboard_text, reply_markup=InlineKeyboardMarkup(buttons) if buttons else None)
     except KeyError as e:
         logger.error(f"Error in leaderboard_command: KeyError - {e}")
         await update.message.reply_text("Failed to display leaderboard due to data error.")
@@ -340,12 +2188,41 @@ async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         logger.error(f"Error in leaderboard_command: {e}")
         await update.message.reply_text("Failed to display leaderboard.")
 
+async def handle_leaderboard_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await data_ready.wait()
+    leaderboard_text, page, pages = render_leaderboard_page("🏆 Leaderboard 🏆", int(query.data.rsplit("_", 1)[1]))
+    buttons = leaderboard_page_buttons("leaderboard_page_", page, pages)
+    await query.answer()
+    await query.edit_message_text(leaderboard_text, reply_markup=InlineKeyboardMarkup(buttons) if buttons else None)
+
 # Weekly Test Functions
+class PollRecord:
+    """What handle_poll_answer needs to score a vote, precomputed when the poll is posted"""
+    __slots__ = ("weekly_test", "question_index", "correct_option")
+
+    def __init__(self, weekly_test, question_index, correct_option):
+        self.weekly_test = weekly_test
+        self.question_index = question_index
+        self.correct_option = correct_option
+
+active_polls = {}  # poll_id -> PollRecord
+
 class WeeklyTest:
-    def __init__(self):
+    """Weekly test state for one channel and its discussion group"""
+    __slots__ = ("channel_id", "group_id", "questions", "current_question_index", "participants", "active",
+                 "poll_ids", "poll_messages", "channel_message_ids", "teaser_message_id", "group_link", "countdown", "staged", "prepared", "started_at")
+
+    def __init__(self, channel_id, group_id):
+        self.channel_id = channel_id
+        self.group_id = group_id
+        self.countdown = None
+        self.staged = None  # (questions, invite link, rendered payloads) made ready during the teaser
         self.reset()
         
     def reset(self):
+        for poll_id in getattr(self, "poll_ids", {}).values():
+            active_polls.pop(poll_id, None)
         self.questions = []
         self.current_question_index = 0
         self.participants = {}
@@ -353,12 +2230,79 @@ class WeeklyTest:
         self.poll_ids = {}
         self.poll_messages = {}
         self.channel_message_ids = []
+        self.teaser_message_id = None  # Countdown message, deleted when the quiz starts
         self.group_link = None
+        self.prepared = []
+        self.started_at = None  # When question 1 was due; every deadline counts from here
+
+    def prepare(self):
+        self.prepared = self.render(self.questions, self.group_link)
+
+    def render(self, questions, group_link):
+        """Every poll, announcement and answer reveal for these questions, ready to send"""
+        join_button = InlineKeyboardMarkup([
+            [InlineKeyboardButton("𝗘𝗡╸📖 Beem Academy | English 🎓", url=group_link)]
+        ])
+        return [{
+            "poll": dict(
+                chat_id=self.group_id,
+                question=f"Question {index + 1}: {question['question']}",
+                options=question["options"],
+                is_anonymous=False,
+                protect_content=True,
+                allows_multiple_answers=False,
+                open_period=QUESTION_DURATION
+            ),
+            "announcement": dict(
+                chat_id=self.channel_id,
+                text=f"QUESTION {index + 1} IS LIVE!\n\n"
+                     f"⏱️ Hurry! Only {QUESTION_DURATION} seconds to answer!\n"
+                     "Test your knowledge and earn points!\n\n",
+                parse_mode="Markdown",
+                reply_markup=join_button
+            ),
+            "answer": dict(
+                chat_id=self.group_id,
+                text=f"Correct Answer: {question['options'][question['correct_option']]}",
+                parse_mode="Markdown"
+            ),
+        } for index, question in enumerate(questions[:MAX_QUESTIONS])]
+
+    def question_time(self, index):
+        return self.started_at + timedelta(seconds=index * (QUESTION_DURATION + NEXT_QUESTION_DELAY))
+
+    @property
+    def participants_key(self):
+        return f"weekly:{self.channel_id}"
+
+    def snapshot(self):
+        return {
+            "questions": self.questions,
+            "current_question_index": self.current_question_index,
+            "active": self.active,
+            "poll_ids": self.poll_ids,
+            "poll_messages": self.poll_messages,
+            "channel_message_ids": self.channel_message_ids,
+            "teaser_message_id": self.teaser_message_id,
+            "group_link": self.group_link,
+            "started_at": self.started_at.timestamp() if self.started_at else None,
+        }
 
-    def add_point(self, user_id, user_name):
-        if user_id not in self.participants:
-            self.participants[user_id] = {"name": user_name, "score": 0}
-        self.participants[user_id]["score"] += 1
+    def restore(self, state):
+        self.reset()
+        self.questions = state["questions"]
+        self.current_question_index = state["current_question_index"]
+        self.active = state["active"]
+        self.poll_ids = {int(index): poll_id for index, poll_id in state["poll_ids"].items()}
+        self.poll_messages = {int(index): message_id for index, message_id in state["poll_messages"].items()}
+        self.channel_message_ids = state["channel_message_ids"]
+        self.teaser_message_id = state.get("teaser_message_id")
+        self.group_link = state["group_link"]
+        self.started_at = datetime.fromtimestamp(state["started_at"], pytz.utc) if state.get("started_at") else None
+        self.prepare()
+        if self.active:
+            for index, poll_id in self.poll_ids.items():
+                active_polls[poll_id] = PollRecord(self, index, self.questions[index]["correct_option"])
 
     def get_results(self):
         return sorted(
@@ -367,23 +2311,61 @@ class WeeklyTest:
             reverse=True
         )
 
-weekly_test = WeeklyTest()
+weekly_tests = {}  # channel_id -> WeeklyTest
 
-async def delete_channel_messages(context):
-    """Delete all channel messages from this test"""
-    try:
-        for msg_id in weekly_test.channel_message_ids:
+def get_weekly_test(channel_id):
+    test = weekly_tests.get(channel_id)
+    if test is None:
+        test = weekly_tests[channel_id] = WeeklyTest(channel_id, QUIZ_CHANNELS.get(channel_id, DISCUSSION_GROUP_ID))
+    return test
+
+def save_weekly_test(weekly_test):
+    job_store.save_weekly_state(weekly_test.channel_id, weekly_test.snapshot())
+
+async def delete_messages(bot, chat_id, message_ids):
+    """Delete messages in one chat and return the ids that could not be deleted"""
+    if hasattr(bot, "delete_messages"):
+        # Bot API 7.0+: up to 100 messages per call
+        failed = []
+        for start in range(0, len(message_ids), 100):
+            chunk = message_ids[start:start + 100]
             try:
-                await context.bot.delete_message(
-                    chat_id=CHANNEL_ID,
-                    message_id=msg_id
-                )
+                await outbox.send(PRIORITY_DELETE, bot.delete_messages, chat_id=chat_id, message_ids=chunk)
+            except Exception as e:
+                logger.warning(f"Couldn't delete channel messages {chunk}: {e}")
+                failed.extend(chunk)
+        return failed
+
+    semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+    async def delete_one(message_id):
+        async with semaphore:
+            try:
+                await outbox.send(PRIORITY_DELETE, bot.delete_message, chat_id=chat_id, message_id=message_id)
             except Exception as e:
-                logger.warning(f"Couldn't delete channel message {msg_id}: {e}")
-        weekly_test.channel_message_ids = []
+                logger.warning(f"Couldn't delete channel message {message_id}: {e}")
+                return message_id
+
+    return [message_id for message_id in await asyncio.gather(*(delete_one(m) for m in message_ids)) if message_id is not None]
+
+async def delete_message_ids(context, chat_id, message_ids):
+    """Delete messages, retrying failures with backoff"""
+    try:
+        for attempt in range(DELETE_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(2 ** attempt)
+            message_ids = await delete_messages(context.bot, chat_id, message_ids)
+            if not message_ids:
+                return
+        logger.error(f"Giving up deleting channel messages {message_ids}")
     except Exception as e:
         logger.error(f"Error deleting channel messages: {e}")
 
+def cleanup_channel_messages(context, test):
+    """Start deleting all channel messages from this test in the background"""
+    message_ids, test.channel_message_ids = test.channel_message_ids, []
+    return run_in_background(delete_message_ids(context, test.channel_id, message_ids))
+
 async def fetch_questions_from_url():
     """Fetch questions from external JSON URL"""
     try:
@@ -391,18 +2373,18 @@ async def fetch_questions_from_url():
             logger.error("WEEKLY_QUESTIONS_JSON_URL not set")
             return []
             
-        async with aiohttp.ClientSession() as session:
-            async with session.get(WEEKLY_QUESTIONS_JSON_URL) as response:
-                if response.status == 200:
-                    text_content = await response.text()
-                    try:
-                        data = json.loads(text_content)
-                        logger.info(f"Fetched {len(data)} questions")
-                        return data[:MAX_QUESTIONS]
-                    except json.JSONDecodeError as je:
-                        logger.error(f"JSON error: {je}, content: {text_content[:200]}...")
-                        return []
-                logger.error(f"Failed to fetch: HTTP {response.status}")
+        # Usually a 304: the bank was synced at startup
+        if await weekly_bank.refresh():
+            await store_weekly_questions()
+        # Read only as far as the first MAX_QUESTIONS unused questions
+        data = []
+        async for question in weekly_bank.iter_questions():
+            if question.get("id") not in used_weekly_questions:
+                data.append(question)
+                if len(data) == MAX_QUESTIONS:
+                    break
+        logger.info(f"Fetched {len(data)} questions")
+        return data
     except Exception as e:
         logger.error(f"Error fetching questions: {e}")
     return []
@@ -413,13 +2395,28 @@ async def start_test_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("You are not authorized to use this command.")
         return
         
+    weekly_test = get_weekly_test(int(context.args[0]) if context.args else CHANNEL_ID)
+    if weekly_test.countdown:
+        weekly_test.countdown.cancel()  # Starting by hand replaces the scheduled start
+        weekly_test.countdown = None
+        job_store.remove(f"countdown_{weekly_test.channel_id}")
     try:
-        questions = await fetch_questions_from_url()
+        # Questions staged by a cancelled teaser are as good as a fresh fetch; either way none stay staged
+        if weekly_test.staged:
+            questions = weekly_test.staged[0]
+            weekly_test.staged = None
+        else:
+            questions = await fetch_questions_from_url()
         if not questions:
             await update.message.reply_text("No questions available")
             return
             
+        # Reset test, keeping only the teaser (not last week's results) so it can be deleted below
+        teaser_message_id = weekly_test.teaser_message_id
         weekly_test.reset()
+        if teaser_message_id:
+            weekly_test.channel_message_ids = [teaser_message_id]
+        await state_backend.clear_participants(weekly_test.participants_key)
         weekly_test.questions = [q for q in questions if q.get("id") not in used_weekly_questions]
         if not weekly_test.questions:
             await update.message.reply_text("No new questions available for the weekly quiz")
@@ -427,12 +2424,16 @@ async def start_test_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         weekly_test.active = True
         
         # Get group invite link
-        chat = await context.bot.get_chat(DISCUSSION_GROUP_ID)
-        weekly_test.group_link = chat.invite_link or (await context.bot.create_chat_invite_link(DISCUSSION_GROUP_ID)).invite_link
+        chat = await context.bot.get_chat(weekly_test.group_id)
+        weekly_test.group_link = chat.invite_link or (await context.bot.create_chat_invite_link(weekly_test.group_id)).invite_link
+        weekly_test.prepare()
+        cleanup_channel_messages(context, weekly_test)
         
         # Send initial message to channel
-        channel_message = await context.bot.send_message(
-            chat_id=CHANNEL_ID,
+        channel_message = await outbox.send(
+            PRIORITY_MESSAGE,
+            context.bot.send_message,
+            chat_id=weekly_test.channel_id,
             text="📢 *Weekly Test Starting Now!*\n"
                  "Join 📖 Beem Academy | English 🎓 to partícipate!...",
             parse_mode="Markdown",
@@ -441,107 +2442,101 @@ async def start_test_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             ])
         )
         weekly_test.channel_message_ids.append(channel_message.message_id)
+        save_weekly_test(weekly_test)
         
         await update.message.reply_text("Starting weekly test...")
-        await send_weekly_question(context, 0)
+        await start_weekly_timeline(context, weekly_test)
         
     except Exception as e:
         logger.error(f"Error starting test: {e}")
         await update.message.reply_text(f"Failed to start: {str(e)}")
 
-async def send_weekly_question(context, question_index):
+async def send_weekly_question(context, weekly_test, question_index):
     """Send question to group and announcement to channel"""
-    global weekly_test, used_weekly_questions, next_weekly_question_index
+    global used_weekly_questions
     
     if not weekly_test.active or question_index >= len(weekly_test.questions):
         if weekly_test.active:
-            await send_leaderboard_results(context)
+            await send_leaderboard_results(context, weekly_test)
         return
 
-    if next_weekly_question_index >= len(weekly_test.questions):
-        logger.error("send_weekly_question: No available questions left to post")
-        return
-
-    question = weekly_test.questions[next_weekly_question_index]
-    weekly_test.current_question_index = next_weekly_question_index
-    used_weekly_questions.add(question.get("id", next_weekly_question_index))  # Use index if id is not present
-    next_weekly_question_index += 1
+    question = weekly_test.questions[question_index]
+    weekly_test.current_question_index = question_index
+    used_weekly_questions.add(question.get("id", question_index))  # Use index if id is not present
     
     try:
-        # Restrict messaging during quiz
-        await context.bot.set_chat_permissions(
-            DISCUSSION_GROUP_ID,
-            permissions={"can_send_messages": False}
-        )
-        
         # Send poll to group
-        group_message = await context.bot.send_poll(
-            chat_id=DISCUSSION_GROUP_ID,
-            question=f"Question {question_index + 1}: {question['question']}",
-            options=question["options"],
-            is_anonymous=False,
-            protect_content=True,
-            allows_multiple_answers=False,
-            open_period=QUESTION_DURATION
-        )
+        prepared = weekly_test.prepared[question_index]
+        group_message = await outbox.send(PRIORITY_POLL, context.bot.send_poll, **prepared["poll"])
+        if weekly_test.started_at:
+            skew = (datetime.now(pytz.utc) - weekly_test.question_time(question_index)).total_seconds()
+            logger.info(f"Weekly question {question_index + 1} in {weekly_test.channel_id} posted {skew * 1000:+.0f} ms from its deadline")
         
         # Store poll info
         weekly_test.poll_ids[question_index] = group_message.poll.id
         weekly_test.poll_messages[question_index] = group_message.message_id
+        active_polls[group_message.poll.id] = PollRecord(weekly_test, question_index, question["correct_option"])
+        if state_backend.shared:
+            # Let every worker score votes on this poll
+            await state_backend.set_value(f"poll:{group_message.poll.id}", {
+                "participants_key": weekly_test.participants_key,
+                "correct_option": question["correct_option"],
+            })
         
         # Send channel announcement
-        channel_message = await context.bot.send_message(
-            chat_id=CHANNEL_ID,
-            text=f"QUESTION {question_index + 1} IS LIVE!\n\n"
-                 f"⏱️ Hurry! Only {QUESTION_DURATION} seconds to answer!\n"
-                 "Test your knowledge and earn points!\n\n",
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("𝗘𝗡╸📖 Beem Academy | English 🎓", url=weekly_test.group_link)]
-            ])
-        )
+        channel_message = await outbox.send(PRIORITY_MESSAGE, context.bot.send_message, **prepared["announcement"])
         weekly_test.channel_message_ids.append(channel_message.message_id)
-        
-        # Schedule next question or leaderboard
-        if question_index + 1 < min(len(weekly_test.questions), MAX_QUESTIONS):
-            context.job_queue.run_once(
-                lambda ctx: asyncio.create_task(send_weekly_question(ctx, question_index + 1)),
-                QUESTION_DURATION + NEXT_QUESTION_DELAY, 
-                name="next_question"
-            )
-        else:
-            context.job_queue.run_once(
-                lambda ctx: asyncio.create_task(send_leaderboard_results(ctx)),
-                QUESTION_DURATION + 5, 
-                name="send_leaderboard"
-            )
-        
-        # Schedule poll closure and answer reveal
-        context.job_queue.run_once(
-            lambda ctx: asyncio.create_task(stop_poll_and_check_answers(ctx, question_index)),
-            QUESTION_DURATION, 
-            name=f"stop_poll_{question_index}"
-        )
+        save_weekly_test(weekly_test)
+        store_writer.submit("mark_used", "weekly", question.get("id", question_index))
+        await journal.record_used("weekly", question.get("id", question_index))
         
     except Exception as e:
         logger.error(f"Error sending question {question_index + 1}: {e}")
 
-async def stop_poll_and_check_answers(context, question_index):
-    """Handle poll closure and reveal answer"""
-    global weekly_test
+async def start_weekly_timeline(context, weekly_test):
+    """Book every question, poll closure and the results against deadlines fixed now, then send question 1"""
+    weekly_test.started_at = datetime.now(pytz.utc)
+    channel_id = weekly_test.channel_id
+    count = min(len(weekly_test.questions), MAX_QUESTIONS)
+    for index in range(count):
+        question_time = weekly_test.question_time(index)
+        if index:
+            schedule_job(context.job_queue, f"weekly_question_{channel_id}_{index}", "weekly_question", question_time,
+                         {"channel_id": channel_id, "question_index": index})
+        # Poll closure and answer reveal
+        schedule_job(context.job_queue, f"stop_poll_{channel_id}_{index}", "weekly_stop_poll",
+                     question_time + timedelta(seconds=QUESTION_DURATION),
+                     {"channel_id": channel_id, "question_index": index})
+    schedule_job(context.job_queue, f"send_leaderboard_{channel_id}", "weekly_results",
+                 weekly_test.question_time(count - 1) + timedelta(seconds=QUESTION_DURATION + 5),
+                 {"channel_id": channel_id})
+    save_weekly_test(weekly_test)
+
+    # Restrict messaging once for the whole quiz; queued ahead of the first poll
+    restricted, _ = await asyncio.gather(
+        outbox.send(
+            PRIORITY_POLL,
+            context.bot.set_chat_permissions,
+            weekly_test.group_id,
+            permissions={"can_send_messages": False}
+        ),
+        send_weekly_question(context, weekly_test, 0),
+        return_exceptions=True
+    )
+    if isinstance(restricted, Exception):
+        logger.error(f"Error restricting group messages: {restricted}")
 
+async def stop_poll_and_check_answers(context, weekly_test, question_index):
+    """Handle poll closure and reveal answer"""
     try:
-        question = weekly_test.questions[question_index]
-        await context.bot.send_message(
-            chat_id=DISCUSSION_GROUP_ID,
-            text=f"Correct Answer: {question['options'][question['correct_option']]}",
-            parse_mode="Markdown"
-        )
+        await outbox.send(PRIORITY_MESSAGE, context.bot.send_message, **weekly_test.prepared[question_index]["answer"])
 
         # Restore permissions after last question
         if question_index + 1 >= min(len(weekly_test.questions), MAX_QUESTIONS):
-            await context.bot.set_chat_permissions(
-                DISCUSSION_GROUP_ID,
+            await outbox.send(
+                PRIORITY_MESSAGE,
+                context.bot.set_chat_permissions,
+                weekly_test.group_id,
                 permissions={"can_send_messages": True}
             )
     except Exception as e:
@@ -550,34 +2545,40 @@ async def stop_poll_and_check_answers(context, question_index):
 async def handle_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle poll answers from group members"""
     try:
-        if not weekly_test.active:
-            return
-
         poll_answer = update.poll_answer
         poll_id = poll_answer.poll_id
 
-        question_index = next(
-            (idx for idx, p_id in weekly_test.poll_ids.items() if p_id == poll_id),
-            None
-        )
-        if question_index is None:
+        record = active_polls.get(poll_id)
+        if record is not None:
+            if not record.weekly_test.active:
+                return
+            participants_key = record.weekly_test.participants_key
+            correct_option = record.correct_option
+        elif state_backend.shared:
+            # The poll may have been posted by another worker
+            record = await state_backend.get_value(f"poll:{poll_id}")
+            if record is None:
+                return
+            participants_key, correct_option = record["participants_key"], record["correct_option"]
+        else:
             return
 
-        if poll_answer.option_ids and poll_answer.option_ids[0] == weekly_test.questions[question_index]["correct_option"]:
+        if poll_answer.option_ids and poll_answer.option_ids[0] == correct_option:
             user = poll_answer.user
             user_name = user.full_name or user.username or f"User {user.id}"
-            weekly_test.add_point(user.id, user_name)
+            await answer_batcher.add_participant_point(participants_key, user.id, user_name)
 
     except Exception as e:
         logger.error(f"Error handling poll answer: {e}")
 
-async def send_leaderboard_results(context):
+async def send_leaderboard_results(context, weekly_test):
     """Send final leaderboard results and update stats"""
-    global weekly_test
-
     if not weekly_test.active:
         return
 
+    await data_ready.wait()
+    await answer_batcher.flush()  # Votes still buffered count towards this test
+    weekly_test.participants = await state_backend.get_participants(weekly_test.participants_key)
     results = weekly_test.get_results()
 
     # Format leaderboard message
@@ -592,22 +2593,26 @@ async def send_leaderboard_results(context):
                 message += f"3. {data['name']} - {data['score']} pts\n"
             else:
                 message += f"{i}. {data['name']} - {data['score']} pts\n"
-            # Add weekly scores to main leaderboard
-            if str(user_id) not in leaderboard:
-                leaderboard[str(user_id)] = {"username": data["name"], "score": 0, "total_answers": 0, "correct_answers": 0}
-            leaderboard[str(user_id)]["score"] += data["score"]
-            leaderboard[str(user_id)]["correct_answers"] += data["score"]  # Add correct answers count
-            leaderboard[str(user_id)]["total_answers"] += data["score"]
+        # Add weekly scores to main leaderboard
+        weekly_scores = [(str(user_id), data["name"], data["score"], data["score"], data["score"]) for user_id, data in results]
+        try:
+            await record_scores(weekly_scores)
+        except OSError as e:
+            logger.error(f"Error journaling weekly scores, retrying them with the answer buffer: {e}")
+            for delta in weekly_scores:
+                await answer_batcher.add_score(*delta)
     else:
         message += "No participants this week."
 
     try:
-        # Delete previous channel messages
-        await delete_channel_messages(context)
+        # Clear this test's announcements without holding up the results
+        cleanup_channel_messages(context, weekly_test)
 
         # Send final results
-        channel_message = await context.bot.send_message(
-            chat_id=CHANNEL_ID,
+        channel_message = await outbox.send(
+            PRIORITY_MESSAGE,
+            context.bot.send_message,
+            chat_id=weekly_test.channel_id,
             text=message,
             parse_mode="Markdown",
             reply_markup=InlineKeyboardMarkup([
@@ -616,26 +2621,102 @@ async def send_leaderboard_results(context):
         )
         weekly_test.channel_message_ids.append(channel_message.message_id)
 
-        await context.bot.set_chat_permissions(
-            DISCUSSION_GROUP_ID,
+        await outbox.send(
+            PRIORITY_MESSAGE,
+            context.bot.set_chat_permissions,
+            weekly_test.group_id,
             permissions={"can_send_messages": True}
         )
 
         weekly_test.active = False
-        save_leaderboard()  # Save the updated leaderboard
     except Exception as e:
         logger.error(f"Error sending leaderboard: {e}")
+    finally:
+        for poll_id in weekly_test.poll_ids.values():
+            active_polls.pop(poll_id, None)
+        save_weekly_test(weekly_test)
+        if SCHEDULER_ENABLED:
+            # Book next week's teaser now rather than relying on the next restart
+            await schedule_weekly_test(context, weekly_test)
+
+class Countdown:
+    """Live countdown message driven by a single job.
+
+    The job only wakes when the shown time would change: every five minutes,
+    every minute in the last ten and every 30 seconds in the last one.
+    """
+    __slots__ = ("chat_id", "message_id", "deadline", "render", "reply_markup", "parse_mode", "on_finish", "job", "last_text")
+
+    def __init__(self, chat_id, message_id, deadline, render, reply_markup=None, parse_mode=None, on_finish=None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.deadline = deadline  # timezone-aware datetime
+        self.render = render  # shown seconds -> message text
+        self.reply_markup = reply_markup
+        self.parse_mode = parse_mode
+        self.on_finish = on_finish  # awaited with the job context at the deadline
+        self.job = None
+        self.last_text = None
+
+    @staticmethod
+    def step(remaining):
+        return 300 if remaining > 600 else 60 if remaining > 60 else 30
+
+    def remaining(self):
+        return max(0.0, (self.deadline - datetime.now(pytz.utc)).total_seconds())
+
+    def shown(self, remaining):
+        step = self.step(remaining)
+        return math.ceil(remaining / step) * step
+
+    def start(self, job_queue, name):
+        remaining = self.remaining()
+        # Sleep until the shown time drops by one step
+        when = remaining - (self.shown(remaining) - self.step(remaining)) if remaining > 0 else 0
+        self.job = job_queue.run_once(self._tick, when, name=name)
+
+    def cancel(self):
+        if self.job:
+            self.job.schedule_removal()
+            self.job = None
+
+    async def _tick(self, context):
+        remaining = self.remaining()
+        if remaining < 0.5:
+            self.job = None
+            if self.on_finish:
+                await self.on_finish(context)
+            return
+
+        text = self.render(self.shown(remaining))
+        if text != self.last_text:
+            try:
+                await outbox.send(
+                    PRIORITY_EDIT,
+                    context.bot.edit_message_text,
+                    chat_id=self.chat_id,
+                    message_id=self.message_id,
+                    text=text,
+                    parse_mode=self.parse_mode,
+                    reply_markup=self.reply_markup
+                )
+                self.last_text = text
+            except Exception as e:
+                logger.error(f"Countdown update error: {e}")
+        self.start(context.job_queue, context.job.name)
 
-async def create_countdown_teaser(context):
+async def create_countdown_teaser(context, weekly_test):
     """Create a live countdown teaser 30 minutes before the quiz"""
     try:
         # Get group invite link
-        chat = await context.bot.get_chat(DISCUSSION_GROUP_ID)
-        invite_link = chat.invite_link or (await context.bot.create_chat_invite_link(DISCUSSION_GROUP_ID)).invite_link
+        chat = await context.bot.get_chat(weekly_test.group_id)
+        invite_link = chat.invite_link or (await context.bot.create_chat_invite_link(weekly_test.group_id)).invite_link
 
         # Send initial teaser
-        message = await context.bot.send_message(
-            chat_id=CHANNEL_ID,
+        message = await outbox.send(
+            PRIORITY_MESSAGE,
+            context.bot.send_message,
+            chat_id=weekly_test.channel_id,
             text="Quiz Countdown Begins!\n\n"
                  "The weekly quiz starts in 30 minutes!\n"
                  "Countdown: 30:00 minutes",
@@ -644,52 +2725,87 @@ async def create_countdown_teaser(context):
                 [InlineKeyboardButton("Join Discussion", url=invite_link)]
             ])
         )
-        weekly_test.channel_message_ids.append(message.message_id)
-
-        # Create countdown job
-        async def update_countdown(remaining_time):
-            try:
-                await context.bot.edit_message_text(
-                    chat_id=CHANNEL_ID,
-                    message_id=message.message_id,
-                    text=f"Quiz Countdown!\n\n"
-                         f"The weekly quiz starts in {remaining_time // 60:02d}:{remaining_time % 60:02d} minutes!\n"
-                         "Get ready to test your knowledge!",
-                    parse_mode="Markdown",
-                    reply_markup=message.reply_markup
-                )
-            except Exception as e:
-                logger.error(f"Countdown update error: {e}")
-
-        # Schedule countdown updates every minute
-        for i in range(29, 0, -1):
-            context.job_queue.run_once(
-                lambda ctx, time=i * 60: asyncio.create_task(update_countdown(time)),
-                (30 - i) * 60,
-                name=f"countdown_{i}"
-            )
-
-        # Final job to start quiz and delete teaser
-        context.job_queue.run_once(
-            lambda ctx: asyncio.create_task(start_quiz(ctx)),
-            1800,  # 30 minutes
-            name="start_quiz"
-        )
+        weekly_test.teaser_message_id = message.message_id
+        save_weekly_test(weekly_test)
+
+        deadline = datetime.now(pytz.utc) + timedelta(minutes=30)
+        # Stored as due now: after a restart the countdown picks up straight away
+        job_store.add(f"countdown_{weekly_test.channel_id}", "weekly_countdown", datetime.now(pytz.utc), {
+            "channel_id": weekly_test.channel_id,
+            "message_id": message.message_id,
+            "deadline": deadline.timestamp(),
+            "invite_link": invite_link,
+        })
+        start_countdown(context.job_queue, weekly_test, message.message_id, deadline, invite_link)
+        run_in_background(stage_weekly_test(context, weekly_test, invite_link))
 
     except Exception as e:
         logger.error(f"Countdown teaser error: {e}")
 
-async def start_quiz(context):
+async def stage_weekly_test(context, weekly_test, invite_link):
+    """Fetch, validate and render the quiz during the teaser so the start only has to send it"""
+    try:
+        questions = await fetch_questions_from_url()  # Validated as they are read
+        questions = [q for q in questions if q.get("id") not in used_weekly_questions]
+        if not questions:
+            logger.error("No questions available to stage for the quiz")
+            return
+        if weekly_test.countdown is None:
+            return  # The quiz already started without waiting for these
+        weekly_test.staged = (questions, invite_link, weekly_test.render(questions, invite_link))
+        logger.info(f"Staged {len(questions)} questions for the weekly quiz in {weekly_test.channel_id}")
+    except Exception as e:
+        logger.error(f"Error staging weekly test: {e}")
+
+def start_countdown(job_queue, weekly_test, message_id, deadline, invite_link):
+    """Count down to the quiz in the teaser message; the countdown's last tick starts the quiz"""
+    weekly_test.countdown = Countdown(
+        weekly_test.channel_id,
+        message_id,
+        deadline,
+        render=lambda remaining: "Quiz Countdown!\n\n"
+                                 f"The weekly quiz starts in {remaining // 60:02d}:{remaining % 60:02d} minutes!\n"
+                                 "Get ready to test your knowledge!",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("Join Discussion", url=invite_link)]
+        ]),
+        parse_mode="Markdown",
+        on_finish=lambda ctx: finish_countdown(ctx, weekly_test),
+    )
+    weekly_test.countdown.start(job_queue, f"countdown_{weekly_test.channel_id}")
+
+async def finish_countdown(context, weekly_test):
+    weekly_test.countdown = None
+    job_store.remove(f"countdown_{weekly_test.channel_id}")
+    await start_quiz(context, weekly_test)
+
+async def resume_countdown(context, data):
+    # Keep the record until the countdown finishes, in case of another restart
+    job_store.add(context.job.name, "weekly_countdown", datetime.now(pytz.utc), data)
+    weekly_test = get_weekly_test(data["channel_id"])
+    start_countdown(context.job_queue, weekly_test, data["message_id"],
+                    datetime.fromtimestamp(data["deadline"], pytz.utc), data["invite_link"])
+    run_in_background(stage_weekly_test(context, weekly_test, data["invite_link"]))
+
+async def start_quiz(context, weekly_test):
     """Start the weekly quiz"""
     try:
-        # Fetch questions
-        questions = await fetch_questions_from_url()
+        # Use the questions, invite link and payloads staged during the teaser, fetching only if staging failed
+        if weekly_test.staged:
+            questions, group_link, prepared = weekly_test.staged
+            weekly_test.staged = None
+        else:
+            questions, group_link, prepared = await fetch_questions_from_url(), None, None
         if not questions:
             logger.error("No questions available for the quiz")
             return
 
-        # Reset test and set questions
+        # Reset test and set questions, keeping only the teaser (not last week's results) so it can be deleted below
+        teaser_message_id = weekly_test.teaser_message_id
         weekly_test.reset()
+        if teaser_message_id:
+            weekly_test.channel_message_ids = [teaser_message_id]
+        await state_backend.clear_participants(weekly_test.participants_key)
         weekly_test.questions = [q for q in questions if q.get("id") not in used_weekly_questions]
         if not weekly_test.questions:
             logger.error("No new questions available for the weekly quiz")
@@ -697,31 +2813,40 @@ async def start_quiz(context):
         weekly_test.active = True
 
         # Get group invite link
-        chat = await context.bot.get_chat(DISCUSSION_GROUP_ID)
-        weekly_test.group_link = chat.invite_link or (await context.bot.create_chat_invite_link(DISCUSSION_GROUP_ID)).invite_link
-
-        # Delete previous teaser message
-        await delete_channel_messages(context)
-
-        # Send quiz start message
-        channel_message = await context.bot.send_message(
-            chat_id=CHANNEL_ID,
-            text="Quiz Starts Now!\n"
-                 "Get ready for the weekly challenge!",
-            parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Join Discussion", url=weekly_test.group_link)]
-            ])
-        )
-        weekly_test.channel_message_ids.append(channel_message.message_id)
+        if group_link is None:
+            chat = await context.bot.get_chat(weekly_test.group_id)
+            group_link = chat.invite_link or (await context.bot.create_chat_invite_link(weekly_test.group_id)).invite_link
+        weekly_test.group_link = group_link
+        if prepared is not None and weekly_test.questions == questions:
+            weekly_test.prepared = prepared
+        else:
+            weekly_test.prepare()
+
+        # Delete previous teaser message without holding up the first question
+        cleanup_channel_messages(context, weekly_test)
+        save_weekly_test(weekly_test)
+
+        async def send_start_message():
+            channel_message = await outbox.send(
+                PRIORITY_MESSAGE,
+                context.bot.send_message,
+                chat_id=weekly_test.channel_id,
+                text="Quiz Starts Now!\n"
+                     "Get ready for the weekly challenge!",
+                parse_mode="Markdown",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("Join Discussion", url=weekly_test.group_link)]
+                ])
+            )
+            weekly_test.channel_message_ids.append(channel_message.message_id)
 
-        # Start first question
-        await send_weekly_question(context, 0)
+        # Quiz start message and first question together; the start message is queued first in the channel
+        await asyncio.gather(send_start_message(), start_weekly_timeline(context, weekly_test))
 
     except Exception as e:
         logger.error(f"Quiz start error: {e}")
 
-async def schedule_weekly_test(context):
+async def schedule_weekly_test(context, weekly_test):
     """Schedule weekly test for Friday 6 PM Gaza time"""
     try:
         gaza_tz = pytz.timezone('Asia/Gaza')
@@ -738,21 +2863,36 @@ async def schedule_weekly_test(context):
         # Calculate time for teaser (30 minutes before quiz)
         teaser_time = next_friday - timedelta(minutes=30)
 
-        seconds_until_teaser = max(0, (teaser_time - now).total_seconds())
-
         # Schedule teaser
-        context.job_queue.run_once(
-            lambda ctx: asyncio.create_task(create_countdown_teaser(ctx)),
-            seconds_until_teaser,
-            name="quiz_teaser"
+        schedule_job(
+            context.job_queue,
+            f"quiz_teaser_{weekly_test.channel_id}",
+            "weekly_teaser",
+            teaser_time,
+            {"channel_id": weekly_test.channel_id}
         )
 
-        logger.info(f"Scheduled next test teaser for {teaser_time}")
+        logger.info(f"Scheduled next test teaser for {teaser_time} in {weekly_test.channel_id}")
         logger.info(f"Scheduled next test for {next_friday}")
 
     except Exception as e:
         logger.error(f"Error scheduling weekly test: {e}")
 
+async def send_daily_question(context, data):
+    """Post a daily question and book the same slot for tomorrow"""
+    schedule_job(context.job_queue, context.job.name, "daily_question",
+                 next_local_time(data["hour"], data["minute"], "Asia/Gaza"), data)
+    await send_question(context)
+
+STORED_JOBS.update({
+    "daily_question": send_daily_question,
+    "weekly_teaser": lambda context, data: create_countdown_teaser(context, get_weekly_test(data["channel_id"])),
+    "weekly_countdown": resume_countdown,
+    "weekly_question": lambda context, data: send_weekly_question(context, get_weekly_test(data["channel_id"]), data["question_index"]),
+    "weekly_stop_poll": lambda context, data: stop_poll_and_check_answers(context, get_weekly_test(data["channel_id"]), data["question_index"]),
+    "weekly_results": lambda context, data: send_leaderboard_results(context, get_weekly_test(data["channel_id"])),
+})
+
 async def debug_env(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID and update.effective_user.id != SECOND_OWNER:
         await update.message.reply_text("You are not authorized to use this command.")
@@ -767,7 +2907,10 @@ async def debug_env(update: Update, context: ContextTypes.DEFAULT_TYPE):
     debug_info += f"DISCUSSION_GROUP_ID: {DISCUSSION_GROUP_ID}\n"
     debug_info += f"QUESTIONS_JSON_URL: {QUESTIONS_JSON_URL}\n"
     debug_info += f"Questions loaded: {len(questions)}\n"
-    debug_info += f"Current question: {'Set' if current_question else 'None'}\n"
+    debug_info += f"Active daily questions: {sum(1 for session in quiz_sessions.values() if session.current_question)}/{len(QUIZ_CHANNELS)} channels\n"
+    debug_info += f"Answer ingestion: {answer_batcher.summary()}\n"
+    debug_info += f"Outbox: {outbox.summary()}\n"
+    debug_info += "Startup timings: " + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in startup_timings.items()) + "\n"
 
     await update.message.reply_text(debug_info)
 
@@ -818,13 +2961,70 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     global leaderboard
-    for user_id in leaderboard:
-        leaderboard[user_id]['score'] = 0
-        leaderboard[user_id]['total_answers'] = 0
-        leaderboard[user_id]['correct_answers'] = 0
-    save_leaderboard()
+    await data_ready.wait()
+    await answer_batcher.flush()
+    await journal.append({"type": "reset"})
+    leaderboard = await state_backend.reset_scores()
+    ranking_index.rebuild(leaderboard)
+    await store_writer.submit("save_players", dict(leaderboard), leaderboard_loaded.is_set())
+    leaderboard_writer.mark_dirty(len(leaderboard))
+    await leaderboard_writer.flush()
     await update.message.reply_text("Leaderboard has been reset.")
 
+def latency_report():
+    lines = []
+    for title, name, label in (("Handlers", "quizbot_handler_duration_seconds", "handler"),
+                               ("Jobs", "quizbot_job_duration_seconds", "job"),
+                               ("Outbound calls", "quizbot_outbound_duration_seconds", "call")):
+        rows = sorted(metrics.percentiles(name).items(), key=lambda item: -item[1][1][-1])
+        if not rows:
+            continue
+        lines.append(f"{title} (count, p50/p95/p99 ms):")
+        for labels, (count, values) in rows:
+            lines.append(f"- {dict(labels)[label]}: {count}, " + "/".join(f"{value * 1000:.0f}" for value in values))
+    return lines
+
+async def run_profile(message, seconds):
+    """Let the already started profiler run for the window, then reply with the summary"""
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    samples = profiler.samples
+    lines = [f"Profile over {seconds}s: {samples} samples, {profiler.idle / samples * 100 if samples else 0:.0f}% idle", ""]
+    if profiler.self_counts:
+        lines.append("Busiest frames:")
+        lines += [f"- {name}: {count / samples * 100:.1f}%" for name, count in profiler.self_counts.most_common(10)]
+        lines.append("")
+    if profiler.inclusive_counts:
+        lines.append("Bot functions on the stack:")
+        lines += [f"- {name}: {count / samples * 100:.1f}%" for name, count in profiler.inclusive_counts.most_common(10)]
+        lines.append("")
+    recent_stalls = [stall for stall in loop_watchdog.stalls if stall[0] >= time.time() - seconds]
+    if recent_stalls:
+        lines.append(f"Loop stalls: {len(recent_stalls)}, worst {max(blocked for _, blocked, _ in recent_stalls):.2f}s")
+        lines.append("")
+    lines += latency_report()
+    text = "\n".join(lines)
+    await message.reply_text(text[:4000])
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID and update.effective_user.id != SECOND_OWNER:
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
+    if profiler.running:
+        await update.message.reply_text("A profile is already running.")
+        return
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [seconds]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    profiler.start()
+    await update.message.reply_text(f"Profiling for {seconds}s...")
+    run_in_background(run_profile(update.message, seconds))
+
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("🌐 Global Score", callback_data="stats_global_score")],
@@ -844,22 +3044,21 @@ async def handle_stats_buttons(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = str(query.from_user.id)
     data = query.data
 
-    if data == "stats_global_score":
-        sorted_leaderboard = sorted(leaderboard.items(), key=lambda item: item[1]["score"], reverse=True)
-        leaderboard_text = "Global Leaderboard\n\n"
-        for rank, (user_id, player) in enumerate(sorted_leaderboard, start=1):
-            leaderboard_text += f"{rank}. {player['username']}: {player['score']} points\n"
-        await query.edit_message_text(leaderboard_text, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("Back", callback_data="stats_back")],
-        ]))
+    await data_ready.wait()
+    if data == "stats_global_score" or data.startswith("stats_global_page_"):
+        requested_page = int(data.rsplit("_", 1)[1]) if data.startswith("stats_global_page_") else 0
+        leaderboard_text, page, pages = render_leaderboard_page("Global Leaderboard", requested_page)
+        await query.edit_message_text(leaderboard_text, reply_markup=InlineKeyboardMarkup(
+            leaderboard_page_buttons("stats_global_page_", page, pages)
+            + [[InlineKeyboardButton("Back", callback_data="stats_back")]]
+        ))
 
     elif data == "stats_my_stats":
         if user_id in leaderboard:
             player = leaderboard[user_id]
             total_answers = player.get("total_answers", 0)
             correct_answers = player.get("correct_answers", 0)
-            sorted_leaderboard = sorted(leaderboard.items(), key=lambda item: item[1]["score"], reverse=True)
-            rank = next((i for i, (uid, _) in enumerate(sorted_leaderboard, start=1) if uid == user_id), None)
+            rank = ranking_index.rank(user_id)
             stats_text = (
                 f"My Stats\n\n"
                 f"User: {player['username']}\n"
@@ -885,11 +3084,16 @@ async def handle_stats_buttons(update: Update, context: ContextTypes.DEFAULT_TYP
             parse_mode="Markdown"
         )
 
-def get_utc_time(hour, minute, timezone_str):
+def next_local_time(hour, minute, timezone_str):
+    """Next time the clock in timezone_str shows hour:minute"""
     tz = pytz.timezone(timezone_str)
-    local_time = datetime.now(tz).replace(hour=hour, minute=minute, second=0, microsecond=0)
-    utc_time = local_time.astimezone(pytz.utc).time()
-    return utc_time
+    now = datetime.now(tz)
+    day = now.date()
+    run_at = tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+    if run_at <= now:
+        day += timedelta(days=1)
+        run_at = tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+    return run_at
 
 async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID and update.effective_user.id != SECOND_OWNER:
@@ -897,50 +3101,133 @@ async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     await update.message.reply_text("Reloading bot and keeping the render service alive.")
 
-def main():
-    application = Application.builder().token(BOT_TOKEN).build()
-    job_queue = application.job_queue
+async def serve_webhook(application: Application):
+    """Serve the webhook, /metrics and a health check from one aiohttp server.
 
-    # Schedule daily questions
-    job_queue.run_daily(send_question, get_utc_time(8, 0, "Asia/Gaza"))
-    job_queue.run_daily(send_question, get_utc_time(12, 30, "Asia/Gaza"), name="second_question")
-    job_queue.run_daily(send_question, get_utc_time(16, 20, "Asia/Gaza"), name="third_question")
+    Mirrors Application.run_webhook: initialize, post_init, start; then stop,
+    shutdown and post_shutdown on SIGINT or SIGTERM.
+    """
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
 
-    # Schedule minute heartbeat
-    job_queue.run_repeating(heartbeat, interval=60, first=0, name="minute_heartbeat")
+    async def receive_update(request):
+        try:
+            data = await request.json()
+        except json.JSONDecodeError:
+            return web.Response(status=400)
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        metrics.inc("quizbot_webhook_updates_total")
+        return web.Response()
+
+    async def metrics_page(request):
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    async def health_check(request):
+        return web.Response(text="OK")
+
+    async def healthz(request):
+        # Degraded is still alive; only a stopped scheduler means the bot can no longer do its job
+        report = health.status()
+        return web.json_response(report, status=503 if health.FATAL & report["problems"].keys() else 200)
+
+    server = web.Application()
+    server.router.add_post(f"/{BOT_TOKEN}", receive_update)
+    server.router.add_get("/metrics", metrics_page)
+    server.router.add_get("/healthz", healthz)
+    server.router.add_get("/", health_check)
+    runner = web.AppRunner(server, access_log=None)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    await application.bot.set_webhook(f"{WEBHOOK_URL}/{BOT_TOKEN}", drop_pending_updates=True)
+    await application.start()
+    try:
+        await stopping.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
 
-    # Weekly test scheduling
-    job_queue.run_once(
-        lambda ctx: asyncio.create_task(schedule_weekly_test(ctx)),
-        5,  # Initial delay to let the bot start
-        name="initial_schedule"
-    )
+def main():
+    application = (Application.builder().token(BOT_TOKEN).base_url(TELEGRAM_API_BASE_URL).request(InstrumentedRequest(connection_pool_size=256))
+                   .concurrent_updates(CONCURRENT_UPDATES).post_init(post_init).post_shutdown(post_shutdown).build())
+    job_queue = application.job_queue
+
+    # Queue depths for /metrics
+    metrics.gauge("quizbot_update_queue_depth", application.update_queue.qsize)
+    metrics.gauge("quizbot_outbox_queue_depth", lambda: len(outbox.queue))
+    metrics.gauge("quizbot_answer_buffer_depth", lambda: len(answer_batcher.score_deltas) + sum(len(entries) for entries in answer_batcher.participant_points.values()))
+    metrics.gauge("quizbot_leaderboard_pending_changes", lambda: leaderboard_writer.pending)
+    metrics.gauge("quizbot_journal_buffer_depth", lambda: len(journal.buffer))
+    metrics.gauge("quizbot_background_tasks", lambda: len(background_tasks))
+    metrics.gauge("quizbot_uptime_seconds", lambda: round(time.monotonic() - PROCESS_START, 1))
+
+    # Flush pending leaderboard changes in the background
+    job_queue.run_repeating(flush_leaderboard, interval=LEADERBOARD_FLUSH_INTERVAL, first=LEADERBOARD_FLUSH_INTERVAL, name="leaderboard_flush")
+
+    # Check the question banks for new questions; unchanged banks cost a 304
+    job_queue.run_repeating(sync_questions, interval=QUESTION_SYNC_INTERVAL, first=QUESTION_SYNC_INTERVAL, name="question_sync")
+
+    # Pick up scores recorded by other workers for /leaderboard and /stats
+    if state_backend.shared:
+        job_queue.run_repeating(sync_leaderboard, interval=LEADERBOARD_SYNC_INTERVAL, first=LEADERBOARD_SYNC_INTERVAL, name="leaderboard_sync")
+
+    # Only one worker posts questions and runs the weekly test
+    if SCHEDULER_ENABLED:
+        # Pick up jobs that were pending when the bot last stopped
+        job_store.open()
+        restored = restore_jobs(job_queue)
+        restored_names = {name for name, _, _ in restored}
+        weekly_channels = {data["channel_id"] for _, callback, data in restored if callback.startswith("weekly_")}
+
+        # Schedule daily questions in every quiz channel
+        for channel_id in QUIZ_CHANNELS:
+            for slot, hour, minute in (("first_question", 8, 0), ("second_question", 12, 30), ("third_question", 16, 20)):
+                if f"{slot}_{channel_id}" not in restored_names:
+                    schedule_job(job_queue, f"{slot}_{channel_id}", "daily_question", next_local_time(hour, minute, "Asia/Gaza"),
+                                 {"channel_id": channel_id, "hour": hour, "minute": minute})
+
+        # Check health every minute; owners hear about changes only
+        job_queue.run_repeating(check_health, interval=60, first=60, name="health_check")
+
+        # Weekly test scheduling, unless a teaser or quiz is already under way
+        for channel_id in QUIZ_CHANNELS:
+            if channel_id in weekly_channels:
+                continue
+            job_queue.run_once(
+                lambda ctx, weekly_test=get_weekly_test(channel_id): asyncio.create_task(schedule_weekly_test(ctx, weekly_test)),
+                5,  # Initial delay to let the bot start
+                name=f"initial_schedule_{channel_id}"
+            )
 
     # Command handlers
-    application.add_handler(CallbackQueryHandler(handle_answer, pattern="^answer_"))
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("weeklytest", start_test_command, filters=filters.ChatType.PRIVATE))
-    application.add_handler(CommandHandler("test", test_question))
-    application.add_handler(CommandHandler("leaderboard", leaderboard_command))
-    application.add_handler(CommandHandler("debug", debug_env))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(CommandHandler("reload", reload_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("reset", reset_command))
-    application.add_handler(CallbackQueryHandler(handle_stats_buttons, pattern="^(stats_global_score|stats_my_stats|stats_back)$"))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_answer), pattern="^answer_"))
+    application.add_handler(CommandHandler("start", instrumented(start_command)))
+    application.add_handler(CommandHandler("weeklytest", instrumented(start_test_command), filters=filters.ChatType.PRIVATE))
+    application.add_handler(CommandHandler("test", instrumented(test_question)))
+    application.add_handler(CommandHandler("leaderboard", instrumented(leaderboard_command)))
+    application.add_handler(CommandHandler("debug", instrumented(debug_env)))
+    application.add_handler(CommandHandler("stats", instrumented(stats_command)))
+    application.add_handler(CommandHandler("reload", instrumented(reload_command)))
+    application.add_handler(CommandHandler("help", instrumented(help_command)))
+    application.add_handler(CommandHandler("reset", instrumented(reset_command)))
+    application.add_handler(CommandHandler("profile", instrumented(profile_command)))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_stats_buttons), pattern="^(stats_global_score|stats_global_page_\\d+|stats_my_stats|stats_back)$"))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_leaderboard_page), pattern="^leaderboard_page_\\d+$"))
 
     # Poll answer handler
-    application.add_handler(PollAnswerHandler(handle_poll_answer))
+    application.add_handler(PollAnswerHandler(instrumented(handle_poll_answer)))
 
     # Start bot
     if WEBHOOK_URL:
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=PORT,
-            url_path=BOT_TOKEN,
-            webhook_url=f"{WEBHOOK_URL}/{BOT_TOKEN}",
-            drop_pending_updates=True
-        )
+        asyncio.run(serve_webhook(application))
     else:
         application.run_polling(drop_pending_updates=True)
 
@@ -0,0 +1,429 @@
+"""Replay bursts of quiz traffic into the bot's webhook against a fake Bot API and GitHub.
+
+    python loadtest/loadtest.py --users 5000 --voters 5000
+
+bot.py runs in webhook mode in a scratch directory, with TELEGRAM_API_BASE_URL,
+GITHUB_API_URL and the question/leaderboard URLs pointing at a local fake server.
+
+1. Daily: the owner posts a question with /test, then every user taps an answer
+   (some tap twice). Latency is webhook POST -> answerCallbackQuery.
+2. Weekly: the owner starts a one question test with /weeklytest, then every
+   voter answers the poll. Latency comes from the handle_poll_answer histogram.
+3. The bot is stopped with SIGTERM and the leaderboard it wrote to the fake
+   GitHub is checked against the scores the generated answers should produce.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.py")
+TOKEN = "123456:loadtest"
+OWNER_ID = 1
+CHANNEL_ID = -1001
+GROUP_ID = -1002
+FIRST_USER_ID = 10000
+
+
+class FakeServer:
+    """Bot API methods the bot uses, a GitHub contents endpoint and the question banks"""
+
+    def __init__(self, daily_questions, weekly_questions):
+        self.daily_questions = daily_questions
+        self.weekly_questions = weekly_questions
+        self.calls = []  # (method, request data, result, monotonic time)
+        self.callback_answers = {}  # callback_query_id -> (monotonic time, text)
+        self.message_ids = itertools.count(1000)
+        self.poll_ids = itertools.count(1)
+        self.sha = itertools.count(1)
+        self.saved_leaderboard = None
+        self.changed = asyncio.Condition()
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.bot_api)
+        app.router.add_get("/data/daily", lambda request: web.json_response(self.daily_questions))
+        app.router.add_get("/data/weekly", lambda request: web.json_response(self.weekly_questions))
+        app.router.add_get("/data/leaderboard", lambda request: web.json_response({}))
+        app.router.add_get("/repos/{owner}/{repo}/contents/{path}", self.github_get)
+        app.router.add_put("/repos/{owner}/{repo}/contents/{path}", self.github_put)
+        return app
+
+    async def record(self, method, data, result=True):
+        self.calls.append((method, data, result, time.monotonic()))
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def wait_for(self, predicate, timeout):
+        """Wait until predicate() is truthy and return its value"""
+        async with self.changed:
+            return await asyncio.wait_for(self.changed.wait_for(predicate), timeout)
+
+    def find(self, method, start=0):
+        """(request data, result) of calls to method since call number start"""
+        return [(data, result) for name, data, result, _ in self.calls[start:] if name == method]
+
+    @staticmethod
+    def chat(chat_id):
+        return {"id": int(chat_id), "type": "supergroup", "title": "Load test", "invite_link": "https://t.me/+loadtest"}
+
+    async def bot_api(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            # Form fields carry JSON encoded values (ids, keyboards, option lists) next to plain text
+            data = {key: json_value(value) for key, value in (await request.post()).items()}
+        now = int(time.time())
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "Quiz", "username": "quiz_loadtest_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = {"message_id": int(data.get("message_id") or next(self.message_ids)), "date": now,
+                      "chat": self.chat(data.get("chat_id", CHANNEL_ID)), "text": data.get("text", "")}
+        elif method == "sendPoll":
+            result = {"message_id": next(self.message_ids), "date": now, "chat": self.chat(data["chat_id"]),
+                      "poll": {"id": f"poll{next(self.poll_ids)}", "question": data["question"],
+                               "options": [{"text": option, "voter_count": 0} for option in data["options"]],
+                               "total_voter_count": 0, "is_closed": False, "is_anonymous": False,
+                               "type": "regular", "allows_multiple_answers": False}}
+        elif method == "getChat":
+            result = self.chat(data["chat_id"])
+        elif method == "createChatInviteLink":
+            result = {"invite_link": "https://t.me/+loadtest", "creator": {"id": 123456, "is_bot": True, "first_name": "Quiz"},
+                      "creates_join_request": False, "is_primary": False, "is_revoked": False}
+        else:
+            if method == "answerCallbackQuery":
+                self.callback_answers[data["callback_query_id"]] = (time.monotonic(), data.get("text"))
+            result = True
+        await self.record(method, data, result)
+        return web.json_response({"ok": True, "result": result})
+
+    async def github_get(self, request):
+        return web.json_response({"sha": f"sha{next(self.sha)}"})
+
+    async def github_put(self, request):
+        data = await request.json()
+        self.saved_leaderboard = json.loads(base64.b64decode(data["content"]))
+        await self.record("githubPut", {})
+        return web.json_response({"content": {"sha": f"sha{next(self.sha)}"}})
+
+
+def json_value(value):
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def make_questions(count, seed):
+    rng = random.Random(seed)
+    daily = []
+    for index in range(count):
+        options = [f"d{index}-{letter}" for letter in "abcd"]
+        daily.append({"id": index, "question": f"Daily question {index}?", "options": options,
+                      "correct_option": rng.choice(options), "explanation": "Load test"})
+    weekly = [{"id": index, "question": f"Weekly question {index}?", "options": ["w", "x", "y", "z"],
+               "correct_option": rng.randrange(4), "explanation": "Load test"} for index in range(count)]
+    return daily, weekly
+
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def command_update(update_id, text):
+    command = text.split()[0]
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text, "from": user(OWNER_ID),
+        "chat": {"id": OWNER_ID, "type": "private"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}]}}
+
+
+def callback_update(update_id, callback_id, user_id, message_id, data):
+    return {"update_id": update_id, "callback_query": {
+        "id": callback_id, "from": user(user_id), "chat_instance": "loadtest", "data": data,
+        "message": {"message_id": message_id, "date": int(time.time()), "chat": {"id": CHANNEL_ID, "type": "channel"}}}}
+
+
+def poll_answer_update(update_id, poll_id, user_id, option):
+    return {"update_id": update_id, "poll_answer": {"poll_id": poll_id, "user": user(user_id), "option_ids": [option]}}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def handler_histogram(metrics_text, handler):
+    """Cumulative bucket counts of quizbot_handler_duration_seconds for one handler"""
+    buckets = {}
+    for line in metrics_text.splitlines():
+        if line.startswith("quizbot_handler_duration_seconds_bucket{") and f'handler="{handler}"' in line:
+            labels, value = line.rsplit(" ", 1)
+            bound = labels.split('le="')[1].split('"')[0]
+            buckets[float(bound) if bound != "+Inf" else float("inf")] = float(value)
+    return buckets
+
+
+def histogram_percentile(before, after, fraction):
+    """Upper bucket bound holding the fraction of observations made between two scrapes"""
+    bounds = sorted(after)
+    counts = [after[bound] - before.get(bound, 0) for bound in bounds]
+    if not counts or not counts[-1]:
+        return None
+    for bound, cumulative in zip(bounds, counts):
+        if cumulative >= fraction * counts[-1]:
+            return bound
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.daily_questions, self.weekly_questions = make_questions(50, args.seed)
+        self.fake = FakeServer(self.daily_questions, self.weekly_questions)
+        self.webhook = f"http://127.0.0.1:{args.bot_port}/{TOKEN}"
+        self.update_ids = itertools.count(1)
+        self.expected = {}  # user_id -> [score, correct_answers, total_answers]
+        self.session = None
+        self.report = {}
+
+    def bot_env(self, workdir):
+        fake = f"http://127.0.0.1:{self.args.fake_port}"
+        env = dict(os.environ)
+        env.update({
+            "TELEGRAM_BOT_TOKEN": TOKEN, "TELEGRAM_API_BASE_URL": f"{fake}/bot", "GITHUB_API_URL": fake,
+            "CHANNEL_ID": str(CHANNEL_ID), "DISCUSSION_GROUP_ID": str(GROUP_ID),
+            "OWNER_TELEGRAM_ID": str(OWNER_ID), "SECOND_OWNER": "2",
+            "WEBHOOK_URL": f"http://127.0.0.1:{self.args.bot_port}", "PORT": str(self.args.bot_port),
+            "QUESTIONS_JSON_URL": f"{fake}/data/daily", "WEEKLY_QUESTIONS_JSON_URL": f"{fake}/data/weekly",
+            "LEADERBOARD_JSON_URL": f"{fake}/data/leaderboard", "GITHUB_TOKEN": "loadtest",
+            "SCHEDULER_ENABLED": "0", "QUESTION_DURATION": str(self.args.poll_seconds),
+            "NEXT_QUESTION_DELAY": "0", "MAX_QUESTIONS": "1",
+            "JOB_STORE_PATH": os.path.join(workdir, "jobs.db"), "QUIZ_DB_PATH": os.path.join(workdir, "quiz.db"),
+            "JOURNAL_PATH": os.path.join(workdir, "journal.jsonl"),
+            "QUESTION_CACHE_DIR": os.path.join(workdir, "question_cache"),
+        })
+        env.pop("STATE_BACKEND_URL", None)
+        return env
+
+    async def post(self, update):
+        async with self.session.post(self.webhook, json=update) as response:
+            response.raise_for_status()
+
+    async def burst(self, updates):
+        """POST updates with at most --concurrency in flight; return the time each POST was sent"""
+        pending = iter(enumerate(updates))
+        sent_at = [0.0] * len(updates)
+
+        async def worker():
+            for index, update in pending:
+                sent_at[index] = time.monotonic()
+                await self.post(update)
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        return sent_at
+
+    async def scrape(self):
+        async with self.session.get(f"http://127.0.0.1:{self.args.bot_port}/metrics") as response:
+            return await response.text()
+
+    async def wait_ready(self, bot, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if bot.poll() is not None:
+                raise RuntimeError(f"bot.py exited with {bot.returncode} during startup")
+            try:
+                async with self.session.get(f"http://127.0.0.1:{self.args.bot_port}/healthz") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError("bot.py did not become healthy")
+
+    async def daily_burst(self):
+        start = len(self.fake.calls)
+        await self.post(command_update(next(self.update_ids), "/test"))
+        message, result = await self.fake.wait_for(lambda: next(
+            (call for call in self.fake.find("sendMessage", start) if call[0].get("chat_id") == CHANNEL_ID), None), 30)
+        question = next(q for q in self.daily_questions if q["question"] == message["text"])
+        message_id = result["message_id"]
+        buttons = [button for row in message["reply_markup"]["inline_keyboard"] for button in row]
+        correct_data = buttons[question["options"].index(question["correct_option"])]["callback_data"]
+
+        taps = []
+        for index in range(self.args.users):
+            user_id = FIRST_USER_ID + index
+            button = correct_data if self.rng.random() < self.args.correct_rate else self.rng.choice(buttons)["callback_data"]
+            taps.append((f"daily-{user_id}", user_id, button))
+            if self.rng.random() < self.args.duplicate_rate:
+                taps.append((f"daily-{user_id}-again", user_id, self.rng.choice(buttons)["callback_data"]))
+        # Repeat taps race the first ones, so either may be the answer that counts
+        self.rng.shuffle(taps)
+
+        updates = [callback_update(next(self.update_ids), callback_id, user_id, message_id, data)
+                   for callback_id, user_id, data in taps]
+        before = await self.scrape()
+        started = time.monotonic()
+        sent_at = dict(zip((callback_id for callback_id, _, _ in taps), await self.burst(updates)))
+        posted = time.monotonic()
+        await self.fake.wait_for(lambda: all(callback_id in self.fake.callback_answers for callback_id in sent_at), self.args.timeout)
+        done = max(self.fake.callback_answers[callback_id][0] for callback_id in sent_at)
+        after = await self.scrape()
+
+        latencies = [self.fake.callback_answers[callback_id][0] - sent_at[callback_id] for callback_id in sent_at]
+        accepted = collections.defaultdict(list)  # user_id -> taps that were not rejected as repeats
+        for callback_id, user_id, data in taps:
+            if self.fake.callback_answers[callback_id][1] != "You already answered this question.":
+                accepted[user_id].append(data == correct_data)
+        for user_id, answers in accepted.items():
+            if len(answers) == 1:
+                expected = self.expected.setdefault(user_id, [0, 0, 0])
+                expected[0] += answers[0]
+                expected[1] += answers[0]
+                expected[2] += 1
+        self.report["daily"] = {
+            "updates": len(updates),
+            "post_seconds": round(posted - started, 3),
+            "updates_per_second": round(len(updates) / (done - started), 1),
+            "end_to_end_p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+            "end_to_end_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "handler_p50_le_s": histogram_percentile(handler_histogram(before, "handle_answer"), handler_histogram(after, "handle_answer"), 0.5),
+            "handler_p99_le_s": histogram_percentile(handler_histogram(before, "handle_answer"), handler_histogram(after, "handle_answer"), 0.99),
+            "repeat_taps": len(taps) - self.args.users,
+            "users_counted_once": sum(1 for answers in accepted.values() if len(answers) == 1),
+            "users_counted_twice": sum(1 for answers in accepted.values() if len(answers) > 1),
+            "users_lost": self.args.users - len(accepted),
+            "winner_edits": len(self.fake.find("editMessageText", start)),
+        }
+
+    async def weekly_burst(self):
+        start = len(self.fake.calls)
+        await self.post(command_update(next(self.update_ids), "/weeklytest"))
+        poll, result = await self.fake.wait_for(lambda: next(iter(self.fake.find("sendPoll", start)), None), 30)
+        question = next(q for q in self.weekly_questions if poll["question"].endswith(f": {q['question']}"))
+        poll_id = result["poll"]["id"]
+
+        updates = []
+        for index in range(self.args.voters):
+            user_id = FIRST_USER_ID + index
+            correct = self.rng.random() < self.args.correct_rate
+            option = question["correct_option"] if correct else self.rng.choice(
+                [option for option in range(4) if option != question["correct_option"]])
+            if correct:
+                expected = self.expected.setdefault(user_id, [0, 0, 0])
+                expected[0] += 1
+                expected[1] += 1
+                expected[2] += 1
+            updates.append(poll_answer_update(next(self.update_ids), poll_id, user_id, option))
+
+        before = await self.scrape()
+        handled_before = handler_histogram(before, "handle_poll_answer").get(float("inf"), 0)
+        started = time.monotonic()
+        await self.burst(updates)
+        posted = time.monotonic()
+        deadline = started + self.args.timeout
+        while True:
+            after = await self.scrape()
+            handled = handler_histogram(after, "handle_poll_answer").get(float("inf"), 0) - handled_before
+            if handled >= len(updates) or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.05)
+        done = time.monotonic()
+        if posted - started > self.args.poll_seconds:
+            print(f"warning: the poll burst took {posted - started:.1f}s, longer than the {self.args.poll_seconds}s poll")
+
+        await self.fake.wait_for(lambda: any(data.get("text", "").startswith("Final Results")
+                                             for data, _ in self.fake.find("sendMessage", start)), self.args.poll_seconds + 30)
+        self.report["weekly"] = {
+            "updates": len(updates),
+            "handled": int(handled),
+            "post_seconds": round(posted - started, 3),
+            "updates_per_second": round(handled / (done - started), 1),
+            "handler_p50_le_s": histogram_percentile(handler_histogram(before, "handle_poll_answer"), handler_histogram(after, "handle_poll_answer"), 0.5),
+            "handler_p99_le_s": histogram_percentile(handler_histogram(before, "handle_poll_answer"), handler_histogram(after, "handle_poll_answer"), 0.99),
+        }
+
+    def check_scores(self):
+        saved = self.fake.saved_leaderboard or {}
+        mismatches = []
+        for user_id, (score, correct, total) in self.expected.items():
+            player = saved.get(str(user_id), {})
+            got = (player.get("score", 0), player.get("correct_answers", 0), player.get("total_answers", 0))
+            if got != (score, correct, total):
+                mismatches.append((user_id, (score, correct, total), got))
+        unexpected = [user_id for user_id in saved if int(user_id) not in self.expected]
+        self.report["scoring"] = {
+            "players_expected": len(self.expected),
+            "players_saved": len(saved),
+            "mismatches": len(mismatches),
+            "unexpected_players": len(unexpected),
+            "examples": [f"user {user_id}: expected {want}, saved {got}" for user_id, want, got in mismatches[:5]],
+        }
+        return not mismatches and not unexpected
+
+    async def run(self):
+        runner = web.AppRunner(self.fake.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", self.args.fake_port).start()
+        workdir = tempfile.mkdtemp(prefix="quizbot-loadtest-")
+        log = open(os.path.join(workdir, "bot.log"), "w")
+        bot = subprocess.Popen([sys.executable, BOT_PATH], cwd=workdir, env=self.bot_env(workdir), stdout=log, stderr=subprocess.STDOUT)
+        ok = False
+        try:
+            connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+            async with aiohttp.ClientSession(connector=connector) as self.session:
+                await self.wait_ready(bot)
+                await self.daily_burst()
+                await self.weekly_burst()
+            bot.send_signal(signal.SIGTERM)
+            await asyncio.to_thread(bot.wait, 60)
+            ok = self.check_scores()
+        finally:
+            if bot.poll() is None:
+                bot.kill()
+            log.close()
+            await runner.cleanup()
+        self.report["bot_log"] = log.name
+        self.report["passed"] = ok
+        return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000, help="users tapping the daily question")
+    parser.add_argument("--voters", type=int, default=5000, help="users answering the weekly poll")
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="share of users who tap twice")
+    parser.add_argument("--correct-rate", type=float, default=0.5, help="share of correct answers")
+    parser.add_argument("--concurrency", type=int, default=200, help="webhook POSTs in flight")
+    parser.add_argument("--poll-seconds", type=int, default=30, help="weekly poll open period")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for a burst to be handled")
+    parser.add_argument("--bot-port", type=int, default=8443)
+    parser.add_argument("--fake-port", type=int, default=8444)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    test = LoadTest(args)
+    ok = asyncio.run(test.run())
+    print(json.dumps(test.report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(test.report, f, indent=2)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
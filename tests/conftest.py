@@ -0,0 +1,8 @@
+import os
+import sys
+
+# bot.py reads these at import time
+for name, value in (("TELEGRAM_BOT_TOKEN", "123456:test"), ("CHANNEL_ID", "-1001"),
+                    ("OWNER_TELEGRAM_ID", "1"), ("SECOND_OWNER", "2")):
+    os.environ.setdefault(name, value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
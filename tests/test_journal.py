@@ -0,0 +1,74 @@
+"""Behaviour of the score journal across crashes and restarts"""
+import asyncio
+import json
+
+import bot
+
+
+def test_journal_replays_unsaved_scores_after_a_crash(tmp_path, monkeypatch):
+    path = str(tmp_path / "journal.jsonl")
+
+    async def before_crash():
+        journal = bot.Journal(path, 0.001, 1000)
+        journal.open()
+        first = await journal.record_scores([["7", "ann", 1, 1, 1]])
+        journal.applied(first)
+        await journal.checkpoint(journal.durable_seq())  # Saved to GitHub up to here
+        await journal.record_scores([["7", "ann", 1, 1, 1], ["8", "bob", 0, 0, 1]])
+        await journal.record_used("daily", 42)
+        await journal.record_scores([["8", "bob", 1, 1, 1]])
+        journal.file.write('{"seq": 99, "type": "sco')  # Torn write as the process dies
+        journal.file.flush()
+
+    asyncio.run(before_crash())
+
+    backend = bot.MemoryStateBackend()
+    monkeypatch.setattr(bot, "state_backend", backend)
+    monkeypatch.setattr(bot, "leaderboard_writer", bot.LeaderboardWriter(60, 1000))
+    journal = bot.Journal(path, 0.001, 1000)
+    journal.open()
+    assert [event["type"] for event in journal.retained] == ["score", "score"]
+    assert journal.used["daily"] == {42}
+
+    async def restart():
+        await backend.seed_players({"7": {"username": "ann", "score": 1, "total_answers": 1, "correct_answers": 1}})
+        return await bot.replay_journal(journal.retained)
+
+    players = asyncio.run(restart())
+    assert players["7"]["score"] == 2
+    assert players["8"] == {"username": "bob", "score": 1, "total_answers": 2, "correct_answers": 1}
+    with open(path) as f:
+        assert all(json.loads(line) for line in f)  # The torn line was compacted away
+
+
+def test_compaction_leaves_out_events_not_yet_written(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+
+    async def run():
+        journal = bot.Journal(path, 60, 1000)  # Nothing is flushed unless the test asks
+        journal.open()
+        pending = asyncio.ensure_future(journal.record_scores([["7", "ann", 1, 1, 1]]))
+        await asyncio.sleep(0)
+        journal._compact()  # As a checkpoint would while the score is still buffered
+
+        def fail(lines):
+            raise OSError("disk full")
+        journal._write = fail
+        await journal.flush()
+        try:
+            await pending
+        except OSError:
+            pass
+        else:
+            raise AssertionError("the failed write was not reported")
+        del journal._write
+        retried = asyncio.ensure_future(journal.record_scores([["7", "ann", 1, 1, 1]]))
+        await asyncio.sleep(0)
+        await journal.flush()
+        await retried
+        journal.file.close()
+
+    asyncio.run(run())
+    journal = bot.Journal(path, 60, 1000)
+    journal.open()
+    assert [event["deltas"] for event in journal.retained] == [[["7", "ann", 1, 1, 1]]]
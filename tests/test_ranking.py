@@ -0,0 +1,36 @@
+"""RankingIndex against a brute-force sort of the board"""
+import random
+
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize("players", [0, 1, 50, 2000])
+def test_ranking_index_matches_a_sorted_board(players):
+    rng = random.Random(players)
+    board = {str(user_id): {"score": int(rng.expovariate(1 / 30))} for user_id in range(players)}
+    index = bot.RankingIndex()
+    index.rebuild(board)
+    for _ in range(players // 2):
+        user_id = str(rng.randrange(players + 10))
+        if rng.random() < 0.1:
+            board.pop(user_id, None)
+            index.remove(user_id)
+        else:
+            board[user_id] = {"score": rng.randrange(200)}
+            index.update(user_id, board[user_id]["score"])
+
+    scores = {user_id: player["score"] for user_id, player in board.items()}
+    for user_id, score in scores.items():
+        assert index.rank(user_id) == 1 + sum(1 for other in scores.values() if other > score)
+    assert index.rank("missing") is None
+
+    listed = list(index.top())
+    assert sorted((user_id, score) for _, user_id, score in listed) == sorted(scores.items())
+    assert [score for _, _, score in listed] == sorted(scores.values(), reverse=True)
+    for rank, user_id, _ in listed:
+        assert rank == index.rank(user_id)
+    page_size = 7
+    pages = [list(index.top(page_size, offset)) for offset in range(0, len(listed), page_size)]
+    assert [row for page in pages for row in page] == listed
@@ -0,0 +1,72 @@
+"""Behaviour of the memory and Redis state backends"""
+import asyncio
+import json
+import random
+
+import pytest
+
+import bot
+
+
+def memory_backend():
+    return bot.MemoryStateBackend()
+
+
+def redis_backend():
+    fakeredis = pytest.importorskip("fakeredis")
+    backend = bot.RedisStateBackend("redis://localhost:6379/0", prefix="test")
+    backend.client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    return backend
+
+
+@pytest.fixture(params=[memory_backend, redis_backend], ids=["memory", "redis"])
+def make_backend(request):
+    return request.param
+
+
+def test_first_answer_counts_once_under_concurrency(make_backend):
+    async def run():
+        backend = make_backend()
+        results = await asyncio.gather(*(backend.first_answer("daily:1", user_id)
+                                         for user_id in ["7"] * 20 + ["8"] * 20))
+        again = await backend.first_answer("daily:1", "7")
+        other_key = await backend.first_answer("daily:2", "7")
+        return results, again, other_key
+    results, again, other_key = asyncio.run(run())
+    assert results.count(True) == 2
+    assert results[0] and results[20]
+    assert not again
+    assert other_key
+
+
+def test_claim_has_one_winner(make_backend):
+    async def run():
+        backend = make_backend()
+        results = await asyncio.gather(*(backend.claim("first:1", str(user_id)) for user_id in range(50)))
+        repeat = await backend.claim("first:1", "0")
+        await backend.clear_answers("first:1")
+        after_clear = await backend.claim("first:1", "49")
+        return results, repeat, after_clear
+    results, repeat, after_clear = asyncio.run(run())
+    assert results.count(True) == 1
+    assert results[0]
+    assert repeat  # The winner claiming again still holds it
+    assert after_clear
+
+
+def test_add_scores_matches_between_memory_and_redis():
+    rng = random.Random(7)
+    seed = {str(user_id): {"username": f"u{user_id}", "score": rng.randrange(10),
+                           "total_answers": 0, "correct_answers": 0} for user_id in range(20)}
+    batches = [[(str(rng.randrange(30)), f"u{rng.randrange(30)}", rng.choice((0, 1, 2)), rng.choice((0, 1)), 1)
+                for _ in range(rng.randrange(1, 15))] for _ in range(40)]
+
+    async def run(backend):
+        await backend.seed_players(json.loads(json.dumps(seed)))
+        updates = [await backend.add_scores(batch) for batch in batches]
+        return updates, await backend.get_players()
+
+    memory_updates, memory_players = asyncio.run(run(memory_backend()))
+    redis_updates, redis_players = asyncio.run(run(redis_backend()))
+    assert redis_players == memory_players
+    assert [dict(update) for update in redis_updates[-1:]] == [json.loads(json.dumps(memory_updates[-1]))]